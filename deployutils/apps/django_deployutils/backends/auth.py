@@ -24,14 +24,17 @@
 
 from __future__ import absolute_import
 
-import logging, random
+import collections, copy, hashlib, json, logging, threading
 
 from django.contrib.auth.backends import RemoteUserBackend
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
 from django.db.utils import DatabaseError
 
-from ..compat import check_signature, six
-from ....helpers import full_name_natural_split
+from .. import settings
+from ..compat import check_signature
+from ....helpers import LRUCache, full_name_natural_split
 
 # Beware that if you are using
 # `deployutils.apps.django_deployutils.logging.RequestFilter` to add
@@ -41,10 +44,94 @@ LOGGER = logging.getLogger(__name__)
 
 UserModel = get_user_model() #pylint:disable=invalid-name
 
+# First tier of the users cache, local to the process. Users are indexed
+# by ('username', username) and by ('pk', id). Entries are stored as
+# (profile version, user) tuples.
+USERS = LRUCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    timeout=settings.USER_CACHE_TIMEOUT)
+
+# Profile fields passed in the session that are copied to the User model.
+PROFILE_FIELDS = ('email', 'first_name', 'full_name', 'last_name')
+
+
+class UserRegistry(object):
+    """
+    Users kept in memory, indexed both by id and by username, when
+    there is no user table in the database.
+
+    The registry is safe to share between threads. When it grows past
+    *max_size*, the least recently used users are evicted. Since ids are
+    derived from usernames, an evicted user comes back with the same id.
+    """
+    MAX_ID = (1 << 31) - 1
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self._by_id = collections.OrderedDict()
+        self._ids_by_username = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, user_id):
+        return user_id in self._by_id
+
+    def values(self):
+        with self._lock:
+            return list(self._by_id.values())
+
+    @classmethod
+    def user_id_for(cls, username):
+        """
+        Returns a deterministic id in [1, MAX_ID] for *username*.
+        """
+        digest = hashlib.sha256(username.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % cls.MAX_ID + 1
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            user = self._by_id.get(user_id)
+            if user is None:
+                return default
+            self._by_id.move_to_end(user_id)
+            return user
+
+    def get_by_username(self, username):
+        with self._lock:
+            user_id = self._ids_by_username.get(username)
+            if user_id is None:
+                return None
+            self._by_id.move_to_end(user_id)
+            return self._by_id[user_id]
+
+    def get_or_create(self, username):
+        """
+        Returns a tuple (user, created).
+        """
+        with self._lock:
+            user_id = self._ids_by_username.get(username)
+            if user_id is not None:
+                self._by_id.move_to_end(user_id)
+                return self._by_id[user_id], False
+            user_id = self.user_id_for(username)
+            while user_id in self._by_id:
+                # Two usernames hash to the same id.
+                user_id = user_id % self.MAX_ID + 1
+            user = UserModel(id=user_id, username=username)
+            self._by_id[user_id] = user
+            self._ids_by_username[username] = user_id
+            if self.max_size is not None:
+                while len(self._by_id) > self.max_size:
+                    _, evicted = self._by_id.popitem(last=False)
+                    del self._ids_by_username[evicted.username]
+            return user, True
+
 
 class ProxyUserBackend(RemoteUserBackend):
 
-    users = {}
+    users = UserRegistry(max_size=settings.USER_CACHE_MAX_SIZE)
 
     def user_can_authenticate(self, user):
         """
@@ -54,6 +141,91 @@ class ProxyUserBackend(RemoteUserBackend):
         is_active = getattr(user, 'is_active', None)
         return is_active or is_active is None
 
+    @staticmethod
+    def get_profile_version(session_data):
+        """
+        Returns a digest of the profile fields in *session_data* such that
+        cached users are looked up again when those fields change.
+        """
+        if not isinstance(session_data, dict):
+            return None
+        profile = [session_data.get(key) for key in PROFILE_FIELDS]
+        if not any(profile):
+            return None
+        return hashlib.sha256(json.dumps(profile).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _get_shared_cache():
+        """
+        Returns the second tier of the users cache, shared between
+        processes through Django's cache framework, if configured.
+        """
+        if settings.USER_CACHE_ALIAS:
+            return caches[settings.USER_CACHE_ALIAS]
+        return None
+
+    @staticmethod
+    def _shared_cache_key(key):
+        return 'deployutils.user.%s' % hashlib.sha256(
+            repr(key).encode('utf-8')).hexdigest()
+
+    def _get_cached_entry(self, key):
+        entry = USERS.get(key)
+        if entry is None:
+            shared_cache = self._get_shared_cache()
+            if shared_cache is not None:
+                entry = shared_cache.get(self._shared_cache_key(key))
+                if entry is not None:
+                    USERS.set(key, entry)
+        return entry
+
+    def get_cached_user(self, key, profile_version=None):
+        """
+        Returns the user cached under *key*, or None when there is no entry
+        or when the entry was cached for a different *profile_version*.
+
+        Lookups by pk do not check the profile version.
+        """
+        entry = self._get_cached_entry(key)
+        if entry is None:
+            return None
+        cached_version, user = entry
+        if key[0] == 'username' and cached_version != profile_version:
+            return None
+        # The caller (ex: `django.contrib.auth.authenticate`) might set
+        # attributes on the user.
+        return copy.copy(user)
+
+    def set_cached_user(self, user, profile_version=None):
+        # The caller keeps a reference to *user* and might modify it.
+        entry = (profile_version, copy.copy(user))
+        shared_cache = self._get_shared_cache()
+        for key in (('username', user.get_username()), ('pk', user.pk)):
+            USERS.set(key, entry)
+            if shared_cache is not None:
+                shared_cache.set(self._shared_cache_key(key), entry,
+                    timeout=settings.USER_CACHE_TIMEOUT)
+
+    def invalidate_cached_user(self, user):
+        """
+        Removes *user* from both tiers of the users cache such that
+        the next lookup reads the database again.
+        """
+        #pylint:disable=import-outside-toplevel
+        from .session_base import SESSION_AUTH_HASHES
+
+        keys = [('pk', user.pk), ('username', user.get_username())]
+        # The username might have changed since the user was cached.
+        entry = self._get_cached_entry(('pk', user.pk))
+        if entry is not None:
+            keys += [('username', entry[1].get_username())]
+        shared_cache = self._get_shared_cache()
+        for key in keys:
+            USERS.delete(key)
+            if shared_cache is not None:
+                shared_cache.delete(self._shared_cache_key(key))
+        SESSION_AUTH_HASHES.delete(user.pk)
+
     def authenticate(self, request, remote_user=None):
         #pylint:disable=arguments-differ
         # Django <=1.8 and >=1.9 have different signatures.
@@ -70,8 +242,12 @@ class ProxyUserBackend(RemoteUserBackend):
         if not remote_user:
             return None
 
-        user = None
         username = self.clean_username(remote_user)
+        profile_version = self.get_profile_version(request)
+        user = self.get_cached_user(('username', username),
+            profile_version=profile_version)
+        if user is not None:
+            return user if self.user_can_authenticate(user) else None
         try:
             #pylint:disable=protected-access
             if self.create_unknown_user:
@@ -108,27 +284,45 @@ class ProxyUserBackend(RemoteUserBackend):
                     pass
         except DatabaseError as err:
             LOGGER.debug("User table missing from database? (err:%s)", err)
-            # We don't have a auth_user table, so let's build a hash in memory.
-            for user in six.itervalues(self.users):
-                LOGGER.debug("match %s with User(id=%d, username=%s)",
-                    username, user.id, user.username)
-                if user.username == username:
-                    LOGGER.debug("found %d %s", user.id, user.username)
-                    return user
-            # Not found in memory dict
-            user = UserModel(
-                id=random.randint(1, (1 << 32) - 1), username=username)
-            LOGGER.debug("add User(id=%d, username=%s) to cache.",
-                user.id, user.username)
-            self.users[user.id] = user
+            # We don't have a auth_user table, so let's keep users in memory.
+            user, created = self.users.get_or_create(username)
+            if created:
+                LOGGER.debug("add User(id=%d, username=%s) to cache.",
+                    user.id, user.username)
+            else:
+                LOGGER.debug("found %d %s", user.id, user.username)
+            return user if self.user_can_authenticate(user) else None
+        if user is not None:
+            self.set_cached_user(user, profile_version=profile_version)
         return user if self.user_can_authenticate(user) else None
 
     def get_user(self, user_id):
+        user = self.get_cached_user(('pk', user_id))
+        if user is not None:
+            return user if self.user_can_authenticate(user) else None
         try:
             #pylint:disable=protected-access
             user = UserModel._default_manager.get(pk=user_id)
+            self.set_cached_user(user)
         except UserModel.DoesNotExist:
             return None
         except DatabaseError:
             user = self.users.get(user_id, None)
         return user if self.user_can_authenticate(user) else None
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    #pylint:disable=unused-argument
+    """
+    Signal receiver that drops cached copies of a User row when it is
+    saved or deleted (ex: deactivated, demoted).
+
+    ``QuerySet.update()`` does not send signals so users updated that way
+    remain cached until ``USER_CACHE_TIMEOUT`` expires.
+    """
+    ProxyUserBackend().invalidate_cached_user(instance)
+
+post_save.connect(invalidate_cached_user, sender=UserModel,
+    dispatch_uid='deployutils_invalidate_cached_user_on_save')
+post_delete.connect(invalidate_cached_user, sender=UserModel,
+    dispatch_uid='deployutils_invalidate_cached_user_on_delete')
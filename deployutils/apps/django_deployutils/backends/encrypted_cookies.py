@@ -28,7 +28,7 @@ Session Store for encrypted cookies.
 
 from __future__ import absolute_import
 
-import logging, json
+import logging
 
 from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
     SESSION_KEY, authenticate)
@@ -44,6 +44,8 @@ LOGGER = logging.getLogger(__name__)
 
 class SessionStore(SessionBase):
 
+    session_formats = (crypt.OPENSSL_FORMAT, crypt.AEAD_FORMAT)
+
     def __init__(self, session_key=None):
         super(SessionStore, self).__init__(session_key=session_key)
         self._session_key_data = {}
@@ -70,13 +72,24 @@ class SessionStore(SessionBase):
           key=...
           iv=...
           _json_formatted_
+
+        When ``settings.ENCRYPTION_FORMAT`` is ``'aead'``, the session
+        is encrypted in an authenticated, versioned envelope instead.
+        Both formats are accepted by ``parse``.
+
+        When ``settings.SESSION_COMPRESSION`` is True, the json string
+        is compressed before it is encrypted.
         """
         if passphrase is None:
             passphrase = settings.DJAODJIN_SECRET_KEY
+        session_text = crypt.json_dumps(session_data)
+        if settings.SESSION_COMPRESSION:
+            session_text = crypt.compress(session_text)
         encrypted = crypt.encrypt(
-            json.dumps(session_data, cls=crypt.JSONEncoder),
+            session_text,
             passphrase=passphrase,
-            debug_stmt="encrypted_cookies.SessionStore.prepare")
+            debug_stmt="encrypted_cookies.SessionStore.prepare",
+            output_format=settings.ENCRYPTION_FORMAT)
         # b64encode will return `bytes` (Py3) but Django 2.0 is expecting
         # a `str` to add to the cookie header, otherwise it wraps those
         # `bytes` into a b'***' and adds that to the cookie.
@@ -87,6 +100,20 @@ class SessionStore(SessionBase):
             as_text = encrypted
         return as_text
 
+    @staticmethod
+    def parse(session_key, passphrase=None):
+        """
+        Returns the session data encoded in *session_key*, a base64
+        encrypted json string as generated by ``prepare()``.
+        """
+        if passphrase is None:
+            passphrase = settings.DJAODJIN_SECRET_KEY
+        session_text = crypt.decrypt(session_key,
+            passphrase=passphrase,
+            debug_stmt="encrypted_cookies.SessionStore.parse",
+            as_bytes=True)
+        return crypt.json_loads(crypt.decompress(session_text))
+
     def load(self):
         """
         We load the data from the key itself instead of fetching from
@@ -101,10 +128,7 @@ class SessionStore(SessionBase):
         """
         session_data = {}
         try:
-            session_text = crypt.decrypt(self._session_key,
-                passphrase=settings.DJAODJIN_SECRET_KEY,
-                debug_stmt="encrypted_cookies.SessionStore.load")
-            session_data = json.loads(session_text)
+            session_data = self.load_session_key_data()
             self._session_key_data.update(session_data)
             LOGGER.debug("session data (from proxy): %s", session_data)
             # We have been able to decode the session data, let's
@@ -117,7 +141,8 @@ class SessionStore(SessionBase):
                     raise ValueError("Cannot authenticate user.")
                 session_data[SESSION_KEY] = user.id
                 session_data[BACKEND_SESSION_KEY] = user.backend
-                session_data[HASH_SESSION_KEY] = user.get_session_auth_hash()
+                session_data[HASH_SESSION_KEY] = self.get_session_auth_hash(
+                    user)
                 if self._local:
                     session_data_local = self._local.load()
                     LOGGER.debug("session data (local): %s", session_data_local)
@@ -137,4 +162,5 @@ class SessionStore(SessionBase):
         session key.
         """
         session_cache = getattr(self, '_session_cache', {})
+        self.nb_encodes += 1
         return self.prepare(session_cache)
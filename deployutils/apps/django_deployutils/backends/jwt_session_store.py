@@ -28,7 +28,7 @@ Session Store for JWT tokens.
 
 from __future__ import absolute_import
 
-import logging
+import logging, time
 
 from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
     SESSION_KEY, authenticate)
@@ -45,8 +45,32 @@ from .session_base import SessionStore as SessionBase
 LOGGER = logging.getLogger(__name__)
 
 
+class _PyJWT(jwt.PyJWT):
+    """
+    Decodes claims with ``crypt.json_loads``.
+
+    Versions of PyJWT that do not call `_decode_payload` keep decoding
+    claims with the stdlib ``json`` module.
+    """
+
+    def _decode_payload(self, decoded):
+        try:
+            payload = crypt.json_loads(decoded['payload'])
+        except ValueError as err:
+            raise jwt.DecodeError("Invalid payload string: %s" % err)
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError(
+                "Invalid payload string: must be a json object")
+        return payload
+
+
+_JWT = _PyJWT()
+
+
 class SessionStore(SessionBase):
 
+    session_formats = (crypt.JWT_FORMAT,)
+
     def __init__(self, session_key=None):
         super(SessionStore, self).__init__(session_key=session_key)
         self._session_key_data = {}
@@ -65,18 +89,24 @@ class SessionStore(SessionBase):
         """
         Returns *session_dict* as a base64 encoded json string.
 
+        When ``settings.SESSION_COMPRESSION`` is True, all claims but `exp`
+        are compressed into a single claim.
         """
         if not session_data:
             return ""
         if passphrase is None:
             passphrase = settings.DJAODJIN_SECRET_KEY
-        exp = as_timestamp(datetime_or_now() + relativedelta(hours=2))
+        exp = as_timestamp(datetime_or_now() + relativedelta(
+            seconds=settings.JWT_EXPIRATION))
         session_data.update({'exp': exp})
-        encoded = jwt.encode(
-            session_data,
+        if settings.SESSION_COMPRESSION:
+            session_data = crypt.compress_claims(session_data)
+        # The claims are serialized here so that we are not tied
+        # to the `json_encoder` hook of `jwt.encode`.
+        encoded = jwt.api_jws.encode(
+            crypt.json_dumps(session_data),
             passphrase,
-            settings.JWT_ALGORITHM,
-            json_encoder=crypt.JSONEncoder)
+            settings.JWT_ALGORITHM)
         # b64encode will return `bytes` (Py3) but Django 2.0 is expecting
         # a `str` to add to the cookie header, otherwise it wraps those
         # `bytes` into a b'***' and adds that to the cookie.
@@ -87,6 +117,19 @@ class SessionStore(SessionBase):
             as_text = encoded
         return as_text
 
+    @staticmethod
+    def parse(session_key, passphrase=None):
+        """
+        Returns the session data encoded in *session_key*, a JWT token
+        as generated by ``prepare()``.
+        """
+        if passphrase is None:
+            passphrase = settings.DJAODJIN_SECRET_KEY
+        return crypt.decompress_claims(_JWT.decode(
+            session_key,
+            passphrase,
+            algorithms=[settings.JWT_ALGORITHM]))
+
     def load(self):
         """
         We load the data from the key itself instead of fetching from
@@ -96,10 +139,7 @@ class SessionStore(SessionBase):
         """
         session_data = {}
         try:
-            session_data = jwt.decode(
-                self._session_key,
-                settings.DJAODJIN_SECRET_KEY,
-                algorithms=[settings.JWT_ALGORITHM])
+            session_data = self.load_session_key_data()
             self._session_key_data.update(session_data)
             LOGGER.debug("session data (from proxy): %s", session_data)
             # We have been able to decode the session data, let's
@@ -112,7 +152,8 @@ class SessionStore(SessionBase):
                     raise ValueError("Cannot authenticate user.")
                 session_data[SESSION_KEY] = user.id
                 session_data[BACKEND_SESSION_KEY] = user.backend
-                session_data[HASH_SESSION_KEY] = user.get_session_auth_hash()
+                session_data[HASH_SESSION_KEY] = self.get_session_auth_hash(
+                    user)
                 if self._local:
                     session_data_local = self._local.load()
                     LOGGER.debug("session data (local): %s", session_data_local)
@@ -124,6 +165,21 @@ class SessionStore(SessionBase):
             return {}
         return session_data
 
+    def should_reissue(self):
+        """
+        Returns ``True`` when a new token must be sent back to the client,
+        either because the session data was modified or because the token
+        went past ``JWT_REFRESH_AFTER`` (a fraction) of its lifetime.
+        """
+        if self.modified:
+            return True
+        exp = self._session.get('exp')
+        if not isinstance(exp, (int, float)):
+            return True
+        refresh_at = exp - settings.JWT_EXPIRATION * (
+            1 - settings.JWT_REFRESH_AFTER)
+        return time.time() >= refresh_at
+
     def _get_session_key(self):
         """
         Most session backends don't need to override this method, but we do,
@@ -131,5 +187,14 @@ class SessionStore(SessionBase):
         generate a secure url-safe Base64-encoded string of data as our
         session key.
         """
+        if not self.should_reissue():
+            # The token passed by the client is still fresh.
+            return self._session_key
         session_cache = getattr(self, '_session_cache', {})
+        self.nb_encodes += 1
         return self.prepare(session_cache)
+
+    def save(self, must_create=False):
+        if self.should_reissue():
+            self._session_key = self._get_session_key()
+        super(SessionStore, self).save(must_create=must_create)
@@ -22,6 +22,8 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import hashlib, time
+
 from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
     SESSION_KEY)
 from django.contrib.sessions.backends.signed_cookies import SessionStore \
@@ -30,12 +32,42 @@ from django.contrib.sessions.models import Session
 
 from .. import settings
 from ..compat import import_string
+from .... import crypt
+from ....helpers import LRUCache
+
+# Payloads decoded from session keys, serialized back to json and indexed
+# by a digest of the key, so repeated requests with the same cookie skip
+# the crypto (and the decompression) but still get a fresh dictionnary.
+DECODED_SESSIONS = LRUCache(
+    max_size=settings.SESSION_CACHE_MAX_SIZE,
+    timeout=settings.SESSION_CACHE_TIMEOUT)
+
+# Digests of session keys that recently failed to decode, so bots and stale
+# browsers replaying the same bad cookie only cost a dictionnary lookup.
+INVALID_SESSIONS = LRUCache(
+    max_size=settings.SESSION_CACHE_MAX_SIZE,
+    timeout=settings.SESSION_INVALID_CACHE_TIMEOUT)
+
+
+# `User.get_session_auth_hash()` computes an HMAC on every call. The result
+# only depends on the user and its password hash. Entries are indexed by
+# user pk so they can be dropped when the user changes.
+SESSION_AUTH_HASHES = LRUCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    timeout=settings.USER_CACHE_TIMEOUT)
 
 
 class SessionStore(SessionBase):
 
+    # Formats of session keys this store knows how to decode
+    # (see ``crypt.guess_format``).
+    session_formats = ()
+
     def __init__(self, session_key=None):
         super(SessionStore, self).__init__(session_key=session_key)
+        # Number of times the session data was encoded into a session key
+        # (reported in the `deployutils.perf` log).
+        self.nb_encodes = 0
         self._local = None
         if settings.BACKEND_SESSION_STORE:
             local_cls = import_string(settings.BACKEND_SESSION_STORE)
@@ -67,6 +99,57 @@ class SessionStore(SessionBase):
             return self._local._session
         return {}
 
+    @staticmethod
+    def get_session_auth_hash(user):
+        password = getattr(user, 'password', None)
+        cached = SESSION_AUTH_HASHES.get(user.pk)
+        if cached is not None and cached[0] == password:
+            return cached[1]
+        session_auth_hash = user.get_session_auth_hash()
+        SESSION_AUTH_HASHES.set(user.pk, (password, session_auth_hash))
+        return session_auth_hash
+
+    def load_session_key_data(self):
+        """
+        Returns the session data encoded in the session key, re-using
+        the payload decoded on a previous request with the same key when
+        it is still valid.
+
+        Concrete stores decode the session key through their ``parse()``
+        method.
+        """
+        session_key = self._session_key
+        if hasattr(session_key, 'encode'):
+            session_key = session_key.encode('utf-8')
+        digest = hashlib.sha256(session_key).digest()
+        session_text = DECODED_SESSIONS.get(digest)
+        if session_text is None:
+            if INVALID_SESSIONS.get(digest):
+                raise ValueError("session key recently failed to decode")
+            # Only keys that decoded successfully are cached, so the format
+            # needs to be checked on a miss only.
+            if (crypt.guess_format(self._session_key)
+                not in self.session_formats):
+                raise ValueError("session key is not in a supported format")
+            try:
+                session_data = self.parse(self._session_key)
+                if not isinstance(session_data, dict):
+                    raise ValueError("session data is not a dictionnary")
+            except Exception:
+                INVALID_SESSIONS.set(digest, True)
+                raise
+            timeout = None
+            if isinstance(session_data.get('exp'), (int, float)):
+                # Do not keep the payload around past its expiration.
+                timeout = session_data['exp'] - time.time()
+            DECODED_SESSIONS.set(digest, crypt.json_dumps(session_data),
+                timeout=timeout)
+            return session_data
+        # Callers add authentication fields to the returned dictionnary,
+        # and views may update nested values (ex: roles) in place, so each
+        # hit parses its own copy.
+        return crypt.json_loads(session_text)
+
     def load(self):
         local_session_data = {}
         if self._local:
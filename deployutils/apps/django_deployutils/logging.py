@@ -24,7 +24,7 @@
 
 from __future__ import absolute_import
 
-import logging, json, os
+import logging, os
 
 from django.core.handlers.wsgi import WSGIRequest
 from django.views.debug import ExceptionReporter
@@ -280,7 +280,7 @@ class JSONFormatter(logging.Formatter):
         formatted = {}
         formatted.update(record_dict)
         formatted.update({
-            'message': json.dumps(record_dict, cls=crypt.JSONEncoder)})
+            'message': crypt.json_dumps(record_dict).decode('utf-8')})
         return self._fmt % formatted
 
     def formatException(self, exc_info, request=None):
@@ -24,8 +24,9 @@
 
 from __future__ import absolute_import
 
-import logging, os, sys
+import logging, multiprocessing, os, sys
 
+import django
 from django.core.management.base import BaseCommand
 
 from ... import settings
@@ -53,6 +54,61 @@ class ResourceCommand(BaseCommand):
         settings.DRY_RUN = options['no_execute']
 
 
+class SessionCommand(BaseCommand):
+    """
+    Commands that process sessions, either passed on the command line
+    or streamed one per line from a file (or stdin).
+
+    Subclasses define a static ``process(line)`` method that returns
+    the output line for an input *line*.
+    """
+    chunk_size = 256
+
+    def add_arguments(self, parser):
+        super(SessionCommand, self).add_arguments(parser)
+        parser.add_argument('--input', action='store', dest='input',
+            default=None,
+            help="read one session per line from a file ('-' for stdin)")
+        parser.add_argument('--jobs', action='store', dest='jobs',
+            type=int, default=1,
+            help="number of processes to spread the work over")
+
+    @staticmethod
+    def _read_lines(input_file):
+        for line in input_file:
+            line = line.strip()
+            if line:
+                yield line
+
+    def handle(self, *args, **options):
+        lines = options.get('sessions', [])
+        input_file = None
+        if options['input'] == '-':
+            lines = self._read_lines(sys.stdin)
+        elif options['input']:
+            #pylint:disable=consider-using-with
+            input_file = open(options['input'])
+            lines = self._read_lines(input_file)
+        pool = None
+        try:
+            if options['jobs'] > 1:
+                # Results are streamed back in the same order as the input.
+                pool = multiprocessing.Pool(
+                    options['jobs'], initializer=django.setup)
+                results = pool.imap(
+                    self.process, lines, chunksize=self.chunk_size)
+            else:
+                results = (self.process(line) for line in lines)
+            for result in results:
+                self.stdout.write(result)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            if input_file:
+                input_file.close()
+
+
 def build_assets():
     """Call django_assets ./manage.py assets build if the app is present."""
     cwd = os.getcwd()
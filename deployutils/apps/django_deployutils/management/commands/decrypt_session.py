@@ -22,15 +22,33 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from django.core.management.base import BaseCommand
+import json
 
+from ..... import crypt
 from ...backends.encrypted_cookies import SessionStore
+from ...backends.jwt_session_store import SessionStore as JWTSessionStore
+from .base import SessionCommand
 
 
-class Command(BaseCommand):
+class Command(SessionCommand):
     help = "Decrypt a session as passed from the front-end."
 
-    def handle(self, *args, **options):
-        store = SessionStore(args[0])
-        session_data = store.load()
-        self.stdout.write(session_data)
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('sessions', metavar='session_key', nargs='*',
+            help="encrypted session key or JWT token")
+
+    @staticmethod
+    def process(line):
+        session_data = {}
+        session_format = crypt.guess_format(line)
+        try:
+            if session_format in JWTSessionStore.session_formats:
+                session_data = JWTSessionStore.parse(line)
+            elif session_format in SessionStore.session_formats:
+                session_data = SessionStore.parse(line)
+        except Exception: #pylint:disable=broad-except
+            # Invalid sessions are output as empty dictionnaries, the same
+            # way `SessionStore.load()` would return them.
+            pass
+        return json.dumps(session_data, cls=crypt.JSONEncoder)
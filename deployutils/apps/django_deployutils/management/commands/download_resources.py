@@ -38,7 +38,10 @@ class Command(ResourceCommand):
         try:
             download(settings.RESOURCES_REMOTE_LOCATION,
                 prefix=settings.MULTITIER_RESOURCES_ROOT,
-                dry_run=settings.DRY_RUN)
+                dry_run=settings.DRY_RUN,
+                max_workers=settings.RESOURCES_TRANSFER_WORKERS,
+                sync_mode=settings.RESOURCES_SYNC_MODE,
+                cache_dir=settings.RESOURCES_CACHE_DIR)
             logging.info("downloaded resources for %s", self.webapp)
         except subprocess.CalledProcessError as err:
             logging.exception(
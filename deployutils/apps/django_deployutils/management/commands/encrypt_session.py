@@ -24,15 +24,18 @@
 
 import json
 
-from django.core.management.base import BaseCommand
-
 from ...backends.encrypted_cookies import SessionStore
+from .base import SessionCommand
 
 
-class Command(BaseCommand):
+class Command(SessionCommand):
     help = "Encrypt session data as the front-end would."
 
-    def handle(self, *args, **options):
-        store = SessionStore()
-        session_key = store.prepare(json.loads(args[0]))
-        self.stdout.write(session_key)
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('sessions', metavar='session_data', nargs='*',
+            help="session data as a JSON string")
+
+    @staticmethod
+    def process(line):
+        return SessionStore.prepare(json.loads(line))
@@ -22,7 +22,7 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import getpass, mimetypes, os
+import getpass, mimetypes, os, tempfile
 
 import boto3
 from django.core.management.base import BaseCommand
@@ -78,18 +78,18 @@ class Command(BaseCommand):
                 headers = {'ContentType': content_type}
             else:
                 headers = {}
-            content = None
-            with open(conf_path) as conf_file:
-                content = conf_file.read()
-            encrypted = crypt.encrypt(content, passphrase)
-            if upload_local:
-                with open(
-                    os.path.join(location, confname), "wb") as upload_file:
-                    upload_file.write(encrypted)
-            else:
-                bucket.put_object(
-                    Key='%s/%s/%s' % (prefix, app_name, confname),
-                    ACL=default_acl,
-                    Body=encrypted,
-                    **headers)
+            with open(conf_path, 'rb') as conf_file:
+                if upload_local:
+                    with open(os.path.join(location, confname),
+                        "wb") as upload_file:
+                        crypt.encrypt_file(conf_file, upload_file, passphrase)
+                else:
+                    with tempfile.TemporaryFile() as encrypted:
+                        crypt.encrypt_file(conf_file, encrypted, passphrase)
+                        encrypted.seek(0)
+                        bucket.put_object(
+                            Key='%s/%s/%s' % (prefix, app_name, confname),
+                            ACL=default_acl,
+                            Body=encrypted,
+                            **headers)
         return 0
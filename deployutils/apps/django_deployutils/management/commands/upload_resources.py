@@ -44,7 +44,11 @@ class Command(ResourceCommand):
             upload(settings.RESOURCES_REMOTE_LOCATION,
                 prefix=settings.MULTITIER_RESOURCES_ROOT,
                 static_root=django_settings.STATIC_ROOT,
-                dry_run=settings.DRY_RUN)
+                dry_run=settings.DRY_RUN,
+                max_workers=settings.RESOURCES_TRANSFER_WORKERS,
+                sync_mode=settings.RESOURCES_SYNC_MODE,
+                checkpoint_ttl=settings.RESOURCES_SYNC_CHECKPOINT_TTL,
+                cache_dir=settings.RESOURCES_CACHE_DIR)
             logging.info("uploaded resources for %s", self.webapp)
         except subprocess.CalledProcessError as err:
             logging.exception(
@@ -37,14 +37,17 @@ from django.contrib.sessions.middleware import SessionMiddleware \
     as BaseMiddleware
 from django.core.exceptions import PermissionDenied
 from django.db import connections
+from django.utils.cache import patch_vary_headers
 
+from ... import crypt
 from . import settings
 from .compat import MiddlewareMixin, is_authenticated
 from .thread_local import clear_cache, set_request
-from ...helpers import datetime_or_now
+from ...helpers import PrefixMatcher, datetime_or_now
 from .backends.jwt_session_store import SessionStore as JWTSessionEngine
 from .backends.encrypted_cookies import (
     SessionStore as EncryptedCookieSessionEngine)
+from .backends.session_base import DECODED_SESSIONS
 
 LOGGER = logging.getLogger(__name__)
 
@@ -54,79 +57,81 @@ class SessionMiddleware(BaseMiddleware):
     JWT_HEADER_NAME = 'HTTP_AUTHORIZATION'
     JWT_SCHEME = 'bearer'
 
-    def check_jwt_session_store(self, request):
-        session_key = None
+    def __init__(self, *args, **kwargs):
+        super(SessionMiddleware, self).__init__(*args, **kwargs)
+        self.allowed_no_session = PrefixMatcher(settings.ALLOWED_NO_SESSION)
+        # Resolves the session engine once instead of on every request.
+        self.engine_class = import_module(
+            django_settings.SESSION_ENGINE).SessionStore
+        if issubclass(self.engine_class, JWTSessionEngine):
+            # Check the Authorization header,
+            # then fall back to the Cookie header.
+            self.candidates = (
+                (self.get_jwt_header, JWTSessionEngine),
+                (self.get_cookie, JWTSessionEngine))
+        else:
+            # Check the Cookie header,
+            # then fall back to the Authorization header.
+            self.candidates = (
+                (self.get_cookie, EncryptedCookieSessionEngine),
+                (self.get_jwt_header, JWTSessionEngine))
+
+    def get_jwt_header(self, request):
         jwt_header = request.META.get(self.JWT_HEADER_NAME)
         if jwt_header:
             jwt_values = jwt_header.split(' ')
             if len(jwt_values) > 1 and \
                 jwt_values[0].lower() == self.JWT_SCHEME:
-                session_key = jwt_values[1]
-
-        # Without a session field, `AuthenticationMiddleware` will complain.
-        request.session = JWTSessionEngine(session_key)
-        # trigger ``load()``
-        if not request.session._session: #pylint: disable=protected-access
-            session_key = None
-        return session_key
-
-    def check_jwt_cookie(self, request):
-        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
-        # Without a session field, `AuthenticationMiddleware` will complain.
-        request.session = JWTSessionEngine(session_key)
-        # trigger ``load()``
-        if not request.session._session: #pylint: disable=protected-access
-            session_key = None
-        return session_key
-
+                return jwt_values[1]
+        return None
 
     @staticmethod
-    def check_encrypted_cookies(request):
-        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
-
-        # Without a session field, `AuthenticationMiddleware` will complain.
-        request.session = EncryptedCookieSessionEngine(session_key)
-        # trigger ``load()``
-        if not request.session._session: #pylint: disable=protected-access
-            session_key = None
-        return session_key
+    def get_cookie(request):
+        return request.COOKIES.get(settings.SESSION_COOKIE_NAME)
 
     def process_request(self, request):
         #pylint:disable=invalid-name
         session_key = None
-        engine = import_module(django_settings.SESSION_ENGINE)
-        if issubclass(engine.SessionStore, JWTSessionEngine):
-            # Check the Authorization header
-            LOGGER.debug("trying JWTSessionEngine with Authorization header.")
-            session_key = self.check_jwt_session_store(request)
-            # Fall back to the Cookie header
-            if not session_key:
-                LOGGER.debug(
-                    "trying fallback JWTSessionEngine with Cookie header.")
-                session_key = self.check_jwt_cookie(request)
-        else:
-            # Check the Cookie header
-            LOGGER.debug("trying EncryptedCookieSessionEngine"\
-                " with Cookie header.")
-            session_key = self.check_encrypted_cookies(request)
-            # Fall back to the Authorization header
-            if not session_key:
-                LOGGER.debug("trying fallback JWTSessionEngine"\
-                    " with Authorization header.")
-                session_key = self.check_jwt_session_store(request)
-
-        # No or incorrect session
+        for get_session_key, engine in self.candidates:
+            candidate_key = get_session_key(request)
+            # Only runs a decoder when the credential looks like something
+            # it could decode.
+            session_format = crypt.guess_format(candidate_key)
+            if session_format not in engine.session_formats:
+                continue
+            LOGGER.debug("trying %s.%s with %s", engine.__module__,
+                engine.__name__, get_session_key.__name__)
+            session = engine(candidate_key)
+            # trigger ``load()``
+            if session._session: #pylint: disable=protected-access
+                request.session = session
+                session_key = candidate_key
+                break
+
         if not session_key:
-            found = False
-            for path in settings.ALLOWED_NO_SESSION:
-                if request.path.startswith(str(path)):
-                    found = True
-                    break
-            if not found:
+            # Without a session field, `AuthenticationMiddleware`
+            # will complain.
+            request.session = self.engine_class(None)
+
+            # No or incorrect session
+            if not self.allowed_no_session.match(request.path):
                 LOGGER.debug("%s not found in %s", request.path,
-                    [str(url) for url in settings.ALLOWED_NO_SESSION])
+                    self.allowed_no_session)
                 raise PermissionDenied("No DjaoDjin session key")
 
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        should_reissue = getattr(session, 'should_reissue', None)
+        if should_reissue is not None and not should_reissue():
+            # The token passed by the client is unchanged and still fresh.
+            # There is no need to sign it again nor to send
+            # a `Set-Cookie` header, even with `SESSION_SAVE_EVERY_REQUEST`.
+            if session.accessed:
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return super(SessionMiddleware, self).process_response(
+            request, response)
+
 
 class RequestLoggingMiddleware(MiddlewareMixin):
 
@@ -156,14 +161,19 @@ class RequestLoggingMiddleware(MiddlewareMixin):
                             # days, seconds, microseconds
                     except ValueError as err:
                         LOGGER.error(err)
+            nb_session_encodes = getattr(
+                getattr(request, 'session', None), 'nb_encodes', 0)
             if hasattr(request, 'starts_at'):
                 request_duration = datetime_or_now() - request.starts_at
                 logger.info(
-                  "%s %s executed %d SQL queries in %s (request duration: %s)",
+                  "%s %s executed %d SQL queries in %s (request duration: %s,"\
+                  " session key encodes: %d)",
                     request.method, request.get_full_path(),
-                    nb_queries, duration, request_duration,
+                    nb_queries, duration, request_duration, nb_session_encodes,
                     extra={'request': request,
                         'nb_queries': nb_queries,
                         'queries_duration': str(duration),
-                        'request_duration': request_duration})
+                        'request_duration': request_duration,
+                        'nb_session_encodes': nb_session_encodes,
+                        'session_cache': DECODED_SESSIONS.stats()})
         return response
@@ -24,6 +24,8 @@
 
 from __future__ import unicode_literals
 
+import bisect, operator
+
 import dateutil, dateutil.relativedelta
 from django.core.exceptions import ImproperlyConfigured
 from django.http import Http404
@@ -48,6 +50,110 @@ class Account(object):
         return str(self.fields[self.lookup_field])
 
 
+class RolesIndex(object):
+    """
+    Index of the roles and profiles found in a session, built once
+    per request, such that permission checks do not walk the whole
+    list of roles and profiles each time.
+    """
+
+    def __init__(self, roles):
+        self.roles = roles
+        if roles is None:
+            roles = {}
+        self.profiles_by_role = {}
+        self.slugs_by_role = {}
+        self.profiles = {}
+        self.roles_by_slug = {}
+        self._results = {}
+        self._timelines = None
+        for role_name, accessible_profiles in six.iteritems(roles):
+            self.profiles_by_role[role_name] = accessible_profiles
+            slugs = set()
+            for accessible_profile in accessible_profiles:
+                slug = accessible_profile.get('slug')
+                slugs.add(slug)
+                self.profiles.setdefault(slug, accessible_profile)
+                self.roles_by_slug.setdefault(slug, set()).add(role_name)
+            self.slugs_by_role[role_name] = slugs
+
+    def get_profiles(self, roles=None):
+        """
+        Returns the list of profiles on which the user has one of *roles*,
+        or any role if *roles* is ``None``.
+        """
+        key = tuple(roles) if roles is not None else None
+        results = self._results.get(key)
+        if results is None:
+            results = []
+            for role_name, accessible_profiles in six.iteritems(
+                    self.profiles_by_role):
+                if roles is None or role_name in roles:
+                    results += accessible_profiles
+            self._results[key] = results
+        return list(results)
+
+    @property
+    def timelines(self):
+        """
+        Subscriptions parsed once and sorted by end time, indexed
+        by profile slug (``None`` for all profiles). Each timeline is
+        a tuple (end times, [(end time, position, plan slug), ...]) where
+        position is the order of the subscription in the session.
+        """
+        if self._timelines is None:
+            timelines = {None: []}
+            position = 0
+            for accessible_profiles in six.itervalues(self.profiles_by_role):
+                for accessible_profile in accessible_profiles:
+                    profile_slug = accessible_profile.get('slug')
+                    for subscription in accessible_profile.get(
+                            'subscriptions', []):
+                        entry = (datetime_or_now(subscription.get('ends_at')),
+                            position, subscription.get('plan'))
+                        position += 1
+                        timelines[None].append(entry)
+                        timelines.setdefault(profile_slug, []).append(entry)
+            self._timelines = {}
+            for key, timeline in six.iteritems(timelines):
+                timeline.sort(key=operator.itemgetter(0))
+                self._timelines[key] = (
+                    [entry[0] for entry in timeline], timeline)
+        return self._timelines
+
+    def get_plans(self, profile=None, at_time=None):
+        """
+        Returns the list of plans that appear under at least one
+        subscription of *profile* (or any profile if ``None``) which ends
+        after *at_time* (if specified).
+        """
+        ends_ats, timeline = self.timelines.get(profile, ([], []))
+        start = bisect.bisect_right(ends_ats, at_time) if at_time else 0
+        plans = {}
+        for _, position, plan_slug in timeline[start:]:
+            if plan_slug not in plans or position < plans[plan_slug]:
+                plans[plan_slug] = position
+        # Plans are returned in the order they first appear
+        # in the subscriptions that were kept.
+        return [{'slug': plan_slug}
+            for plan_slug in sorted(plans, key=plans.get)]
+
+    def has_role(self, slug, roles=None):
+        """
+        Returns ``True`` if the user has one of *roles* (or any role
+        if *roles* is ``None``) on the profile identified by *slug*.
+        """
+        slug_roles = self.roles_by_slug.get(slug)
+        if not slug_roles:
+            return False
+        if roles is None:
+            return True
+        for role_name in roles:
+            if role_name in slug_roles:
+                return True
+        return False
+
+
 class AccessiblesMixin(object):
     """
     Profiles accessibles by the ``request.user`` as defined
@@ -99,6 +205,15 @@ class AccessiblesMixin(object):
         return _get_accessible_profiles(request, roles=roles)
 
 
+    def _overrides_accessible_profiles(self):
+        """
+        Returns ``True`` if a subclass overrides ``get_accessible_profiles``,
+        in which case lookups cannot go through the session roles index.
+        """
+        return (self.__class__.get_accessible_profiles is not
+            AccessiblesMixin.get_accessible_profiles)
+
+
     def get_context_data(self, **kwargs):
         # XXX If we don't call super, we will miss contextes in ListView.
         context = super(AccessiblesMixin, self).get_context_data(**kwargs)
@@ -130,6 +245,9 @@ class AccessiblesMixin(object):
         to a profile slug.
         """
         account_slug = str(account)
+        if not self._overrides_accessible_profiles():
+            return _get_roles_index(self.request).has_role(
+                account_slug, roles=roles)
         for accessible_profile in self.get_accessible_profiles(
                 self.request, roles=roles):
             if account_slug == accessible_profile['slug']:
@@ -194,12 +312,22 @@ class AccountMixin(AccessiblesMixin):
                     # There are no Model in the database backing an account.
                     # We entirely derive it from the the session token passed
                     # by the proxy.
-                    for account in self.get_accessible_profiles(self.request):
-                        if (account[self.account_lookup_field]
-                            == account_lookup_value):
+                    if (self.account_lookup_field in (None, 'slug') and
+                        not self._overrides_accessible_profiles()):
+                        account = _get_roles_index(
+                            self.request).profiles.get(account_lookup_value)
+                        if account is not None:
                             self._account = Account(account,
                                 lookup_field=self.account_lookup_field)
-                            break
+                    else:
+                        lookup_field = (self.account_lookup_field
+                            if self.account_lookup_field else 'slug')
+                        for account in self.get_accessible_profiles(
+                                self.request):
+                            if account[lookup_field] == account_lookup_value:
+                                self._account = Account(account,
+                                    lookup_field=self.account_lookup_field)
+                                break
                 else:
                     if self.account_lookup_field is None:
                         raise ImproperlyConfigured(
@@ -347,24 +475,8 @@ def _get_accessible_plans(request, profile=None, at_time=None):
     Returns the list of plans that appear under at least one subscription
     of a profile the `request.user` has a role on.
     """
-    #pylint:disable=too-many-nested-blocks
-    plans = {}
-    if profile:
-        profile = str(profile)
-    for accessible_profiles in six.itervalues(request.session.get(
-            'roles', {})):
-        for accessible_profile in accessible_profiles:
-            if not profile or profile == accessible_profile.get('slug'):
-                for subscription in accessible_profile.get(
-                        'subscriptions', []):
-                    subscription_ends_at = subscription.get('ends_at')
-                    if (not at_time or
-                        at_time < datetime_or_now(subscription_ends_at)):
-                        plan_key =  subscription.get('plan')
-                        plan = {'slug': plan_key}
-                        if plan_key not in plans:
-                            plans.update({plan_key: plan})
-    return plans.values()
+    return _get_roles_index(request).get_plans(
+        profile=str(profile) if profile else None, at_time=at_time)
 
 
 def _get_accessible_profiles(request, roles=None):
@@ -372,9 +484,18 @@ def _get_accessible_profiles(request, roles=None):
     Returns the list of *dictionnaries* for which the accounts are
     accessibles by ``request.user`` filtered by ``roles`` if present.
     """
-    results = []
-    for role_name, accessible_profiles in six.iteritems(request.session.get(
-            'roles', {})):
-        if roles is None or role_name in roles:
-            results += accessible_profiles
-    return results
+    return _get_roles_index(request).get_profiles(roles=roles)
+
+
+def _get_roles_index(request):
+    """
+    Returns the ``RolesIndex`` for the roles in ``request.session``,
+    building it the first time it is needed in a request.
+    """
+    roles = request.session.get('roles')
+    index = getattr(request, '_roles_index', None)
+    if index is None or index.roles is not roles:
+        # Sessions without roles are indexed once as well (``None``).
+        index = RolesIndex(roles)
+        request._roles_index = index #pylint:disable=protected-access
+    return index
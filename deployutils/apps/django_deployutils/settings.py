@@ -53,18 +53,33 @@ _SETTINGS = {
     'DJAODJIN_SECRET_KEY': os.getenv('DJAODJIN_SECRET_KEY',
         getattr(settings, 'DJAODJIN_SECRET_KEY', None)),
     'DRY_RUN': getattr(settings, 'DEPLOYUTILS_DRY_RUN', False),
+    'ENCRYPTION_FORMAT': 'openssl',
     'INSTALLED_APPS': getattr(settings, 'DEPLOYUTILS_INSTALLED_APPS',
         settings.INSTALLED_APPS),
     'JWT_ALGORITHM': getattr(settings, 'JWT_ALGORITHM', 'HS256'),
+    'JWT_EXPIRATION': 7200,
+    'JWT_REFRESH_AFTER': 0.5,
     'MOCKUP_SESSIONS': {},
     'MULTITIER_RESOURCES_ROOT': getattr(settings, 'DEPLOYUTILS_RESOURCES_ROOT',
         os.path.join(settings.BASE_DIR, 'htdocs')),
     'MULTITIER_ASSETS_DIR': os.path.join(settings.BASE_DIR, 'htdocs'),
     'MULTITIER_THEMES_DIR': os.path.join(settings.BASE_DIR, 'themes'),
     'REQUESTS_TIMEOUT': getattr(settings, 'REQUESTS_TIMEOUT', None),
+    'RESOURCES_CACHE_DIR': os.path.join(
+        os.path.expanduser('~'), '.cache', 'deployutils'),
     'RESOURCES_REMOTE_LOCATION': getattr(settings,
         'DEPLOYUTILS_RESOURCES_REMOTE_LOCATION', None),
+    'RESOURCES_SYNC_CHECKPOINT_TTL': 24 * 3600,
+    'RESOURCES_SYNC_MODE': 'mtime',
+    'RESOURCES_TRANSFER_WORKERS': 8,
+    'SESSION_CACHE_MAX_SIZE': 1024,
+    'SESSION_CACHE_TIMEOUT': 300,
+    'SESSION_INVALID_CACHE_TIMEOUT': 30,
+    'SESSION_COMPRESSION': False,
     'SESSION_COOKIE_NAME': 'sessionid',
+    'USER_CACHE_ALIAS': None,
+    'USER_CACHE_MAX_SIZE': 1024,
+    'USER_CACHE_TIMEOUT': 300,
 }
 _SETTINGS.update(getattr(settings, 'DEPLOYUTILS', {}))
 
@@ -78,7 +93,10 @@ DEPLOYED_WEBAPP_ROOT = _SETTINGS.get('DEPLOYED_WEBAPP_ROOT')
 DEPLOYED_SERVERS = _SETTINGS.get('DEPLOYED_SERVERS')
 DJAODJIN_SECRET_KEY = _SETTINGS.get('DJAODJIN_SECRET_KEY')
 DRY_RUN = _SETTINGS.get('DRY_RUN')
+ENCRYPTION_FORMAT = _SETTINGS.get('ENCRYPTION_FORMAT')
 JWT_ALGORITHM = _SETTINGS.get('JWT_ALGORITHM')
+JWT_EXPIRATION = _SETTINGS.get('JWT_EXPIRATION')
+JWT_REFRESH_AFTER = _SETTINGS.get('JWT_REFRESH_AFTER')
 MOCKUP_SESSIONS = _SETTINGS.get('MOCKUP_SESSIONS')
 MULTITIER_ASSETS_DIR = _SETTINGS.get('MULTITIER_ASSETS_DIR')
 MULTITIER_THEMES_DIR = _SETTINGS.get('MULTITIER_THEMES_DIR')
@@ -86,8 +104,19 @@ MULTITIER_RESOURCES_ROOT = _SETTINGS.get('MULTITIER_RESOURCES_ROOT')
 if not MULTITIER_RESOURCES_ROOT.endswith('/'):
     MULTITIER_RESOURCES_ROOT = MULTITIER_RESOURCES_ROOT + '/'
 REQUESTS_TIMEOUT = _SETTINGS.get('REQUESTS_TIMEOUT')
+RESOURCES_CACHE_DIR = _SETTINGS.get('RESOURCES_CACHE_DIR')
 RESOURCES_REMOTE_LOCATION = _SETTINGS.get('RESOURCES_REMOTE_LOCATION')
+RESOURCES_SYNC_CHECKPOINT_TTL = _SETTINGS.get('RESOURCES_SYNC_CHECKPOINT_TTL')
+RESOURCES_SYNC_MODE = _SETTINGS.get('RESOURCES_SYNC_MODE')
+RESOURCES_TRANSFER_WORKERS = _SETTINGS.get('RESOURCES_TRANSFER_WORKERS')
+SESSION_CACHE_MAX_SIZE = _SETTINGS.get('SESSION_CACHE_MAX_SIZE')
+SESSION_CACHE_TIMEOUT = _SETTINGS.get('SESSION_CACHE_TIMEOUT')
+SESSION_INVALID_CACHE_TIMEOUT = _SETTINGS.get('SESSION_INVALID_CACHE_TIMEOUT')
+SESSION_COMPRESSION = _SETTINGS.get('SESSION_COMPRESSION')
 SESSION_COOKIE_NAME = _SETTINGS.get('SESSION_COOKIE_NAME')
+USER_CACHE_ALIAS = _SETTINGS.get('USER_CACHE_ALIAS')
+USER_CACHE_MAX_SIZE = _SETTINGS.get('USER_CACHE_MAX_SIZE')
+USER_CACHE_TIMEOUT = _SETTINGS.get('USER_CACHE_TIMEOUT')
 
 INSTALLED_APPS = _SETTINGS.get('INSTALLED_APPS')
 SESSION_SAVE_EVERY_REQUEST = getattr(
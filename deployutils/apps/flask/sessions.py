@@ -24,7 +24,7 @@
 
 from __future__ import absolute_import
 
-import json, logging, os
+import logging, os
 
 from flask.sessions import SessionInterface as FlaskSessionInterface
 from flask.sessions import SessionMixin
@@ -32,6 +32,7 @@ from jwt import InvalidSignatureError, decode
 from werkzeug.datastructures import CallbackDict
 
 from ... import crypt
+from ...helpers import PrefixMatcher
 
 
 LOGGER = logging.getLogger(__name__)
@@ -72,7 +73,7 @@ class DjaoDjinSessionInterface(FlaskSessionInterface):
 
     def __init__(self, secret_key=None, allowed_no_session=None):
         self.secret_key = secret_key
-        self.allowed_no_session = (allowed_no_session
+        self.allowed_no_session = PrefixMatcher(allowed_no_session
             if allowed_no_session is not None else [])
 
     def open_session(self, app, request):
@@ -96,31 +97,31 @@ class DjaoDjinSessionInterface(FlaskSessionInterface):
             if len(jwt_values) > 1 and \
                 jwt_values[0].lower() == self.JWT_SCHEME:
                 session_key = jwt_values[1]
-                try:
-                    session_data = decode(
-                        session_key, self.secret_key, JWT_ALGORITHM)
-                except (InvalidSignatureError, TypeError, ValueError) as _:
-                    pass
+                if crypt.guess_format(session_key) == crypt.JWT_FORMAT:
+                    try:
+                        session_data = crypt.decompress_claims(decode(
+                            session_key, self.secret_key, JWT_ALGORITHM))
+                    except (InvalidSignatureError, TypeError, ValueError) as _:
+                        pass
 
         if not session_key:
             session_key = request.cookies.get(app.session_cookie_name)
-            try:
-                session_data = json.loads(crypt.decrypt(
-                    session_key, passphrase=self.secret_key))
-            except (IndexError, TypeError, ValueError) as _:
-                # Incorrect padding in b64decode, incorrect block size in AES,
-                # incorrect PKCS#5 padding or malformed json will end-up here.
-                pass
+            if crypt.guess_format(session_key) in (
+                    crypt.OPENSSL_FORMAT, crypt.AEAD_FORMAT):
+                try:
+                    session_data = crypt.json_loads(crypt.decompress(
+                        crypt.decrypt(session_key, passphrase=self.secret_key,
+                            as_bytes=True)))
+                except (IndexError, TypeError, ValueError) as _:
+                    # Incorrect padding in b64decode, incorrect block size
+                    # in AES, incorrect PKCS#5 padding or malformed json
+                    # will end-up here.
+                    pass
 
         if not session_key:
-            found = False
-            for path in self.allowed_no_session:
-                if request.path.startswith(str(path)):
-                    found = True
-                    break
-            if not found:
+            if not self.allowed_no_session.match(request.path):
                 app.logger.debug("%s not found in %s", request.path,
-                    [str(url) for url in self.allowed_no_session])
+                    self.allowed_no_session)
                 raise PermissionDenied("No DjaoDjin session key")
 
         LOGGER.debug("decoded session data: %s", session_data)
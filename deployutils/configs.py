@@ -225,7 +225,16 @@ def read_config(app_name, *args, **kwargs):
                             "attempt to load config from 's3://%s/%s'\n" %
                             (bucket_name, key_name))
                     data = io.BytesIO()
-                    bucket.download_fileobj(key_name, data)
+                    if passphrase:
+                        # Decrypts as the object is downloaded so we never
+                        # hold both the encrypted and plain text.
+                        body = bucket.Object(key_name).get()['Body']
+                        try:
+                            crypt.decrypt_file(body, data, passphrase)
+                        finally:
+                            body.close()
+                    else:
+                        bucket.download_fileobj(key_name, data)
                     content = data.getvalue()
                     if verbose:
                         sys.stderr.write("config loaded from 's3://%s/%s'\n" %
@@ -242,11 +251,14 @@ def read_config(app_name, *args, **kwargs):
                 prefix=prefix, verbose=verbose)
             if confpath:
                 with open(confpath, 'rb') as conffile:
-                    content = conffile.read()
+                    if passphrase:
+                        data = io.BytesIO()
+                        crypt.decrypt_file(conffile, data, passphrase)
+                        content = data.getvalue()
+                    else:
+                        content = conffile.read()
 
         if content:
-            if passphrase:
-                content = crypt.decrypt(content, passphrase)
             if hasattr(content, 'decode'):
                 content = content.decode('utf-8')
             config[confname] = content
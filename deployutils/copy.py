@@ -25,22 +25,63 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import logging, os, re, subprocess, zipfile
+import hashlib, logging, os, re, sqlite3, subprocess, zipfile
 import requests
 
-from .filesys import list_local
+from .filesys import DigestCache, walk_local
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Digests of local files, and the state of syncs with S3 buckets,
+# are kept there in between runs by default.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'deployutils')
 
-def _resources_files(abs_paths=False):
+
+def _s3_caches(remote_location, prefix, cache_dir=None, dry_run=False):
+    """
+    Returns the ``DigestCache`` and ``SyncState`` used to sync the local
+    *prefix* with *remote_location*.
+
+    Nothing is kept in between runs when *cache_dir* is ``None``.
+    The sync state is also ``None`` on dry runs, or when it cannot
+    be opened in *cache_dir*.
+    """
+    #pylint:disable=import-outside-toplevel
+    from .s3 import SyncState
+    if not cache_dir:
+        return DigestCache(), None
+    digest_cache = DigestCache(os.path.join(cache_dir, 'digests.json'))
+    if dry_run:
+        return digest_cache, None
+    name = hashlib.sha256(
+        ("%s %s" % (remote_location, os.path.abspath(prefix or '.'))).encode(
+            'utf-8')).hexdigest()[:16]
+    try:
+        sync_state = SyncState(
+            os.path.join(cache_dir, 'sync', '%s.sqlite3' % name))
+    except (OSError, sqlite3.Error) as err:
+        LOGGER.warning("syncing without state in %s: %s", cache_dir, err)
+        sync_state = None
+    return digest_cache, sync_state
+
+
+def _resources_files(abs_paths=False, existing_only=True):
+    """
+    Returns the resource directories and the ignore patterns
+    found in `.gitignore`.
+
+    With *existing_only* False, resource directories are returned even
+    when they do not exist locally yet (ex: on a freshly provisioned
+    machine before the first download).
+    """
     remotes = []
     ignores = []
     with open('.gitignore') as gitignore:
         for line in gitignore.readlines():
-            if line.startswith('#'):
-                # ignore comment lines
+            if line.startswith('#') or not line.strip():
+                # ignore comment and blank lines (a blank line would
+                # otherwise stand for the whole project directory).
                 continue
             if abs_paths:
                 pathname = os.path.join(os.getcwd(), line.strip())
@@ -49,25 +90,59 @@ def _resources_files(abs_paths=False):
             if pathname.endswith(os.sep):
                 # os.path.basename will not work as expected if pathname
                 # ends with a '/'.
-                if os.path.isdir(pathname):
+                if not existing_only or os.path.isdir(pathname):
                     remotes += [pathname]
             else:
                 ignores += [pathname]
     return remotes, ignores
 
 
-def download(remote_location, remotes=None, prefix="", dry_run=False):
+def _key_prefixes(remotes, prefix):
+    """
+    Returns the bucket key prefixes where *remotes* are stored.
+    """
+    results = []
+    for remote in remotes:
+        if prefix and remote.startswith(prefix):
+            remote = remote[len(prefix):]
+        results += [remote]
+    return results
+
+
+def download(remote_location, remotes=None, prefix="", dry_run=False,
+             max_workers=None, sync_mode=None, cache_dir=CACHE_DIR):
+    # pylint:disable=too-many-arguments
     """
     Download resources from a stage server.
+
+    When *remote_location* is a S3 bucket, files are downloaded
+    by *max_workers* threads in parallel. *sync_mode* is either
+    'mtime' (default) or 'digest' (see `deployutils.s3.S3Backend`).
+    Digests and the state of syncs are kept in *cache_dir*
+    (``None`` to keep nothing in between runs).
     """
     if remotes is None:
+        # The resource directories are most likely missing
+        # the first time resources are downloaded.
         remotes, _ = _resources_files(
-            abs_paths=remote_location.startswith('s3://'))
+            abs_paths=remote_location.startswith('s3://'),
+            existing_only=False)
     if remote_location.startswith('s3://'):
         #pylint:disable=import-outside-toplevel
         from .s3 import S3Backend
-        backend = S3Backend(remote_location, dry_run=dry_run)
-        backend.download(list_local(remotes, prefix), prefix)
+        digest_cache, sync_state = _s3_caches(remote_location, prefix,
+            cache_dir=cache_dir, dry_run=dry_run)
+        try:
+            backend = S3Backend(remote_location, dry_run=dry_run,
+                max_workers=max_workers,
+                key_prefixes=_key_prefixes(remotes, prefix),
+                sync_mode=sync_mode,
+                digest_cache=digest_cache,
+                sync_state=sync_state)
+            backend.download(walk_local(remotes, prefix), prefix)
+        finally:
+            if sync_state is not None:
+                sync_state.close()
     else:
         dest_root = '.'
         shell_command([
@@ -110,20 +185,44 @@ def shell_command(cmd, dry_run=False):
 
 
 def upload(remote_location, remotes=None, ignores=None,
-           static_root="/static/", prefix="", dry_run=False):
+           static_root="/static/", prefix="", dry_run=False,
+           max_workers=None, sync_mode=None, checkpoint_ttl=None,
+           cache_dir=CACHE_DIR):
     # pylint:disable=too-many-arguments
     """
     Upload resources to a stage server.
+
+    When *remote_location* is a S3 bucket, files are uploaded
+    by *max_workers* threads in parallel. *sync_mode* is either
+    'mtime' (default) or 'digest'. The bucket is listed again once
+    the last complete sync is older than *checkpoint_ttl* seconds
+    (see `deployutils.s3.S3Backend`). Digests and the state of syncs
+    are kept in *cache_dir* (``None`` to keep nothing in between runs).
     """
     if remotes is None:
+        # Key prefixes for the bucket are derived from the resource
+        # directories, whether they exist locally or not, such that
+        # uploads and downloads sync the same set of prefixes.
         remotes, ignores = _resources_files(
-            abs_paths=remote_location.startswith('s3://'))
+            abs_paths=remote_location.startswith('s3://'),
+            existing_only=not remote_location.startswith('s3://'))
     if remote_location.startswith('s3://'):
         #pylint:disable=import-outside-toplevel
         from deployutils.s3 import S3Backend
-        backend = S3Backend(remote_location,
-            static_root=static_root, dry_run=dry_run)
-        backend.upload(list_local(remotes, prefix), prefix)
+        digest_cache, sync_state = _s3_caches(remote_location, prefix,
+            cache_dir=cache_dir, dry_run=dry_run)
+        try:
+            backend = S3Backend(remote_location,
+                static_root=static_root, dry_run=dry_run,
+                max_workers=max_workers,
+                key_prefixes=_key_prefixes(remotes, prefix),
+                sync_mode=sync_mode,
+                digest_cache=digest_cache,
+                sync_state=sync_state, checkpoint_ttl=checkpoint_ttl)
+            backend.upload(walk_local(remotes, prefix), prefix)
+        finally:
+            if sync_state is not None:
+                sync_state.close()
     else:
         excludes = []
         if ignores:
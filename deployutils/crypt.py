@@ -28,19 +28,79 @@ Encryption and Decryption functions
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
-import decimal, json, logging, os
-from base64 import b64decode, b64encode
-from binascii import hexlify
+import decimal, enum, functools, hashlib, inspect, json, logging, math, os
+import re, time
+import zlib
+from base64 import (b64decode, b64encode, urlsafe_b64decode,
+    urlsafe_b64encode)
+from binascii import a2b_base64, b2a_base64, hexlify
 
 import six
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.padding import PKCS7
+
+from .metrics import REGISTRY
+
+try:
+    import orjson
+except ImportError: # orjson is optional
+    orjson = None
 
 LOGGER = logging.getLogger(__name__)
 
+# Key material is only ever logged at this level, below DEBUG.
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+_BACKEND = default_backend()
+
 IV_BLOCK_SIZE = 16
 
+AEAD_FORMAT = 'aead'
+JWT_FORMAT = 'jwt'
+OPENSSL_FORMAT = 'openssl'
+
+# Versioned envelope: version byte, key id, nonce then AES-GCM ciphertext
+# (which ends with the authentication tag).
+AEAD_VERSION = b'\x01'
+AEAD_KEY_ID_SIZE = 4
+AEAD_NONCE_SIZE = 12
+AEAD_TAG_SIZE = 16
+AEAD_HEADER_SIZE = len(AEAD_VERSION) + AEAD_KEY_ID_SIZE + AEAD_NONCE_SIZE
+
+# Streaming functions read input in chunks of that many bytes and,
+# like `openssl -a`, write base64 text in lines of 64 characters.
+STREAM_CHUNK_SIZE = 64 * 1024
+B64_LINE_BYTES = 48
+
+# Number of (passphrase, salt) pairs whose derived key is kept around.
+OPENSSL_KEY_CACHE_SIZE = 1024
+
+# Tokens longer than this are rejected without attempting to decode them.
+MAX_TOKEN_LENGTH = 64 * 1024
+
+# Compressed payloads start with this tag, which cannot start a JSON text,
+# and are never inflated past MAX_DECOMPRESSED_SIZE bytes.
+ZLIB_TAG = b'z:'
+MAX_DECOMPRESSED_SIZE = 1024 * 1024
+# Claim holding the compressed claims in a JWT.
+COMPRESSED_CLAIM = '_z'
+
+# base64 encoding of the b'Salted__' prefix openssl writes in front
+# of the salt, followed by the base64 alphabet.
+OPENSSL_B64_RE = re.compile(r'^U2FsdGVkX1[A-Za-z0-9+/]*={0,2}$')
+# base64 encoding of an envelope always starts with 'A' (version 1).
+AEAD_B64_RE = re.compile(r'^A[A-Za-z0-9+/]*={0,2}$')
+# Three base64url segments. The header starts with the encoding
+# of b'{"'.
+JWT_B64_RE = re.compile(
+    r'^(eyJ[A-Za-z0-9_-]*)\.[A-Za-z0-9_-]*\.[A-Za-z0-9_-]+$')
+
 
 class JSONEncoder(json.JSONEncoder):
 
@@ -59,30 +119,257 @@ class JSONEncoder(json.JSONEncoder):
         return super(JSONEncoder, self).default(obj)
 
 
+_JSON_ENCODER = JSONEncoder(separators=(',', ':'))
+
+if orjson is not None:
+    # Types `JSONEncoder.default` would serialize differently than orjson
+    # are passed through to it. Keys that are not strings make orjson
+    # raise a `TypeError`, so they are serialized by the stdlib.
+    _ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+
+def _orjson_compatible(obj):
+    """
+    Returns ``False`` if *obj* contains values orjson serializes differently
+    than ``JSONEncoder``: enums (written by value instead of ``str()``),
+    non-finite floats (written as null instead of NaN/Infinity) and
+    floats written with an exponent (ex: 1e16 instead of 1e+16).
+
+    Containers are visited once, so circular references end the walk.
+    orjson then fails on them and ``JSONEncoder`` reports the error.
+    """
+    containers = [(obj,)]
+    visited = set()
+    while containers:
+        container = containers.pop()
+        if id(container) in visited:
+            continue
+        visited.add(id(container))
+        for value in (container.values() if isinstance(container, dict)
+                      else container):
+            value_type = type(value)
+            if (value_type is str or value_type is int or
+                value_type is bool or value is None):
+                continue
+            if value_type is dict or value_type is list or value_type is tuple:
+                containers.append(value)
+            elif isinstance(value, enum.Enum):
+                return False
+            elif isinstance(value, float):
+                # `repr()` switches to an exponent outside [1e-4, 1e16).
+                if not math.isfinite(value) or (
+                        value and not 1e-4 <= abs(value) < 1e16):
+                    return False
+            elif isinstance(value, (dict, list, tuple)):
+                containers.append(value)
+    return True
+
+
+def json_dumps(obj):
+    """
+    Returns *obj* serialized as compact JSON `bytes`.
+
+    Values are converted as ``JSONEncoder`` does. orjson is used when it is
+    installed, the stdlib ``json`` module otherwise, or when orjson would
+    serialize *obj* differently (ex: enums, NaN, keys that are not strings)
+    or cannot serialize it at all (ex: integers larger than 64 bits).
+    """
+    if orjson is not None and _orjson_compatible(obj):
+        try:
+            return orjson.dumps(obj, default=_JSON_ENCODER.default,
+                option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass
+    return _JSON_ENCODER.encode(obj).encode('utf-8')
+
+
+def json_loads(text):
+    """
+    Returns the Python object encoded in *text* (`bytes` or `str`)
+    as JSON. Raises ``ValueError`` when *text* is not valid JSON.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except ValueError:
+            # orjson is stricter than the stdlib (ex: NaN).
+            pass
+    return json.loads(text)
+
+
+def guess_format(token):
+    """
+    Returns the format of *token* (``AEAD_FORMAT``, ``JWT_FORMAT``
+    or ``OPENSSL_FORMAT``), or ``None`` when it looks like neither.
+
+    Only structural checks are done here (length, alphabet, block size
+    and JWT header), so that garbage is rejected without going through
+    any crypto.
+    """
+    if not token or len(token) > MAX_TOKEN_LENGTH:
+        return None
+    if not isinstance(token, six.string_types):
+        token = token.decode('ascii', 'ignore')
+    if OPENSSL_B64_RE.match(token):
+        if len(token) % 4 != 0:
+            return None
+        # b'Salted__' + salt, then at least one AES block.
+        nb_bytes = len(token) * 3 // 4 - token.count('=')
+        if (nb_bytes < 2 * IV_BLOCK_SIZE
+            or (nb_bytes - IV_BLOCK_SIZE) % IV_BLOCK_SIZE != 0):
+            return None
+        return OPENSSL_FORMAT
+    if AEAD_B64_RE.match(token):
+        if len(token) % 4 != 0:
+            return None
+        nb_bytes = len(token) * 3 // 4 - token.count('=')
+        if nb_bytes < AEAD_HEADER_SIZE + AEAD_TAG_SIZE:
+            return None
+        return AEAD_FORMAT
+    look = JWT_B64_RE.match(token)
+    if look:
+        header = look.group(1)
+        try:
+            header = json.loads(urlsafe_b64decode(
+                header + '=' * (-len(header) % 4)).decode('utf-8'))
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(header, dict) or 'alg' not in header:
+            return None
+        return JWT_FORMAT
+    return None
+
+
 def _log_debug(salt, key, iv_, encrypted_text, plain_text,
-               passphrase=None, debug_stmt=None):
+               debug_stmt=None):
+    """
+    Dumps the key material when the ``TRACE`` level is enabled. Callers
+    check ``LOGGER.isEnabledFor(TRACE)`` first so that the hex formatting
+    is never paid for in production.
+    """
     #pylint:disable=too-many-arguments
-    if six.PY2:
-        hex_salt = ''.join(["%X" % ord(c) for c in salt])
+    if debug_stmt:
+        LOGGER.log(TRACE, '=========== %s', debug_stmt)
     else:
-        hex_salt = ''.join(["%X" % c for c in salt])
+        LOGGER.log(TRACE, '==========================================')
+    LOGGER.log(TRACE, 'salt:          %s', hexlify(salt).upper())
+    LOGGER.log(TRACE, 'key:           %s', hexlify(key).upper())
+    LOGGER.log(TRACE, 'iv:            %s', hexlify(iv_).upper())
+    LOGGER.log(TRACE, 'encrypt:       %s', encrypted_text)
+    if plain_text:
+        LOGGER.log(TRACE, "plain:         '%s'", plain_text)
+    LOGGER.log(TRACE, '*****************************************')
+
+
+def _instrument(name, measure):
+    """
+    Decorates a crypt function such that calls, failures, duration
+    and bytes processed (as returned by *measure(data, result)*, where
+    *data* is the first argument of the function, passed by position
+    or by keyword) are recorded in the metrics registry under
+    ``crypt.*name*``.
+
+    Errors while measuring are logged, never raised to the caller.
+    """
+    calls = REGISTRY.counter('crypt.%s.calls' % name)
+    failures = REGISTRY.counter('crypt.%s.failures' % name)
+    nb_bytes = REGISTRY.counter('crypt.%s.bytes' % name)
+    seconds = REGISTRY.histogram('crypt.%s.seconds' % name)
+
+    def decorator(func):
+        data_arg = next(iter(inspect.signature(func).parameters))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            calls.inc()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                failures.inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - start)
+            try:
+                nb_bytes.inc(measure(
+                    args[0] if args else kwargs.get(data_arg), result))
+            except Exception as err: #pylint:disable=broad-except
+                LOGGER.debug("cannot measure bytes processed by %s: %s",
+                    name, err)
+            return result
+        return wrapper
+    return decorator
+
+
+@_instrument('compress', lambda data, result: len(data))
+def compress(data):
+    """
+    Returns *data* (`bytes`) compressed and tagged with ``ZLIB_TAG``,
+    or *data* itself when compression does not make it smaller.
+    """
+    compressed = ZLIB_TAG + zlib.compress(data)
+    if len(compressed) >= len(data):
+        compressed = data
+    REGISTRY.counter('crypt.compress.compressed_bytes').inc(len(compressed))
+    return compressed
+
+
+@_instrument('decompress', lambda data, result: len(result))
+def decompress(data):
+    """
+    Returns *data* (`bytes`) inflated when it was compressed by ``compress``,
+    and as-is otherwise.
+    """
+    if data[:len(ZLIB_TAG)] != ZLIB_TAG:
+        return data
+    inflater = zlib.decompressobj()
     try:
-        if debug_stmt:
-            LOGGER.debug('=========== %s', debug_stmt)
-        else:
-            LOGGER.debug('==========================================')
-        LOGGER.debug('passphrase:    %s', passphrase)
-        LOGGER.debug('salt:          %s', hex_salt)
-        LOGGER.debug('key:           %s', hexlify(key).upper())
-        LOGGER.debug('iv:            %s', hexlify(iv_).upper())
-        LOGGER.debug('encrypt:       %s', encrypted_text)
-        if plain_text:
-            if hasattr(plain_text, 'encode'):
-                plain_text.encode('utf-8')
-            LOGGER.debug("plain:         '%s'", plain_text)
-    except UnicodeDecodeError:
-        LOGGER.debug('decryption failed')
-    LOGGER.debug('*****************************************')
+        inflated = inflater.decompress(
+            data[len(ZLIB_TAG):], MAX_DECOMPRESSED_SIZE)
+    except zlib.error as err:
+        raise ValueError("cannot decompress payload: %s" % err)
+    if inflater.unconsumed_tail or not inflater.eof:
+        raise ValueError("decompressed payload is truncated or larger"\
+            " than %d bytes" % MAX_DECOMPRESSED_SIZE)
+    return inflated
+
+
+def compress_claims(claims, uncompressed=('exp',)):
+    """
+    Returns JWT *claims* where all claims but the ones listed
+    in *uncompressed* are serialized, compressed and stored
+    in the ``COMPRESSED_CLAIM`` claim.
+    """
+    packed = {key: val for key, val in six.iteritems(claims)
+        if key not in uncompressed}
+    data = json_dumps(packed)
+    compressed = compress(data)
+    if compressed is data:
+        return claims
+    result = {key: val for key, val in six.iteritems(claims)
+        if key in uncompressed}
+    result.update({
+        COMPRESSED_CLAIM: urlsafe_b64encode(compressed).decode('ascii')})
+    return result
+
+
+def decompress_claims(claims):
+    """
+    Returns JWT *claims* with the ``COMPRESSED_CLAIM`` claim, if present,
+    unpacked back into individual claims.
+    """
+    packed = claims.pop(COMPRESSED_CLAIM, None)
+    if packed is None:
+        return claims
+    if not isinstance(packed, six.string_types):
+        raise ValueError("'%s' claim must be a string" % COMPRESSED_CLAIM)
+    unpacked = json_loads(decompress(urlsafe_b64decode(packed)))
+    if not isinstance(unpacked, dict):
+        raise ValueError("'%s' claim must be a json object" %
+            COMPRESSED_CLAIM)
+    unpacked.update(claims)
+    return unpacked
 
 
 def _openssl_key_iv(passphrase, salt):
@@ -90,29 +377,79 @@ def _openssl_key_iv(passphrase, salt):
     Returns a (key, iv) tuple that can be used in AES symmetric encryption
     from a *passphrase* (a byte or unicode string) and *salt* (a byte array).
     """
-    def _openssl_kdf(req):
-        if hasattr(passphrase, 'encode'):
-            passwd = passphrase.encode('ascii', 'ignore')
-        else:
-            passwd = passphrase
-        prev = b''
-        while req > 0:
-            digest = hashes.Hash(hashes.MD5(), backend=default_backend())
-            digest.update(prev + passwd + salt)
-            prev = digest.finalize()
-            req -= IV_BLOCK_SIZE
-            yield prev
     assert passphrase is not None
     assert salt is not None
-    # AES key: 32 bytes, IV: 16 bytes
-    mat = b''.join(list(_openssl_kdf(32 + IV_BLOCK_SIZE)))
-    return mat[0:32], mat[32:32 + IV_BLOCK_SIZE]
+    if hasattr(passphrase, 'encode'):
+        passwd = passphrase.encode('ascii', 'ignore')
+    else:
+        passwd = passphrase
+    # AES key: 32 bytes, IV: 16 bytes, i.e. 3 rounds of MD5 (EVP_BytesToKey)
+    seed = passwd + salt
+    first = hashlib.md5(seed).digest()
+    second = hashlib.md5(first + seed).digest()
+    third = hashlib.md5(second + seed).digest()
+    return first + second, third
+
+
+@functools.lru_cache(maxsize=OPENSSL_KEY_CACHE_SIZE)
+def _openssl_cipher(passphrase, salt):
+    """
+    Returns a (key, iv, cipher) tuple for a *passphrase* and *salt*.
+
+    Results are memoized so decrypting the same payload again (ex: a session
+    cookie sent on every request) skips the key derivation.
+    """
+    key, iv_ = _openssl_key_iv(passphrase, salt)
+    return key, iv_, Cipher(algorithms.AES(key), modes.CBC(iv_), _BACKEND)
+
+
+@functools.lru_cache(maxsize=16)
+def _aead_key(passphrase):
+    """
+    Returns a tuple (cipher, key id) for a *passphrase*. The key is derived
+    once per passphrase and re-used afterwards.
+    """
+    if hasattr(passphrase, 'encode'):
+        passphrase = passphrase.encode('utf-8')
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+        info=b'deployutils.crypt.aead.v1',
+        backend=_BACKEND).derive(passphrase)
+    key_id = hashlib.sha256(key).digest()[:AEAD_KEY_ID_SIZE]
+    return AESGCM(key), key_id
+
 
+def _aead_decrypt(full_encrypted, passphrase):
+    cipher, key_id = _aead_key(passphrase)
+    header = full_encrypted[:AEAD_HEADER_SIZE]
+    if header[len(AEAD_VERSION):len(AEAD_VERSION) + AEAD_KEY_ID_SIZE] \
+        != key_id:
+        raise ValueError("payload was encrypted with a different key")
+    nonce = header[-AEAD_NONCE_SIZE:]
+    try:
+        plain_text = cipher.decrypt(
+            nonce, full_encrypted[AEAD_HEADER_SIZE:], header)
+    except InvalidTag:
+        raise ValueError("payload failed authentication")
+    return plain_text
+
+
+def _aead_encrypt(source_utf8, passphrase):
+    cipher, key_id = _aead_key(passphrase)
+    nonce = os.urandom(AEAD_NONCE_SIZE)
+    header = AEAD_VERSION + key_id + nonce
+    return b64encode(header + cipher.encrypt(nonce, source_utf8, header))
 
-def decrypt(source_text, passphrase, debug_stmt=None):
+
+@_instrument('decrypt', lambda data, result: len(result))
+def decrypt(source_text, passphrase, debug_stmt=None, as_bytes=False):
     """
     Returns plain text from *source_text*, a base64 AES encrypted string
-    as generated with openssl.
+    as generated by ``encrypt``. The plain text is returned as `bytes`
+    instead of being decoded as utf-8 when *as_bytes* is True.
+
+    Versioned envelopes (``AEAD_FORMAT``) and legacy openssl payloads
+    (``OPENSSL_FORMAT``) are both accepted. The latter as generated
+    with openssl:
 
         $ echo '_source_text_' | openssl aes-256-cbc -a -k _passphrase_ -p
         salt=...
@@ -120,71 +457,206 @@ def decrypt(source_text, passphrase, debug_stmt=None):
         iv=...
         _full_encrypted_
     """
-    salt = ""
-    key = b""
-    iv_ = b""
-    plain_text = ""
-    if debug_stmt is None:
-        debug_stmt = "decrypt"
-    try:
-        full_encrypted = b64decode(source_text)
-        salt = full_encrypted[8:IV_BLOCK_SIZE]
-        encrypted_text = full_encrypted[IV_BLOCK_SIZE:]
-        key, iv_ = _openssl_key_iv(passphrase, salt)
-        cipher = Cipher(
-            algorithms.AES(key), modes.CBC(iv_), default_backend()
-        ).decryptor()
-        plain_text = cipher.update(encrypted_text)
-        plain_text += cipher.finalize()
-        # PKCS#7 padding
-        if six.PY2:
-            padding = ord(plain_text[-1])
-        else:
-            padding = plain_text[-1]
-        plain_text = plain_text[:-padding]
-        if hasattr(plain_text, 'decode'):
-            plain_text = plain_text.decode('utf-8')
-    finally:
+    full_encrypted = b64decode(source_text)
+    if full_encrypted[:len(AEAD_VERSION)] == AEAD_VERSION:
+        plain_text = _aead_decrypt(full_encrypted, passphrase)
+        return plain_text if as_bytes else plain_text.decode('utf-8')
+    salt = full_encrypted[8:IV_BLOCK_SIZE]
+    encrypted_text = full_encrypted[IV_BLOCK_SIZE:]
+    key, iv_, cipher = _openssl_cipher(passphrase, salt)
+    cipher = cipher.decryptor()
+    plain_text = cipher.update(encrypted_text) + cipher.finalize()
+    # PKCS#7 padding
+    if six.PY2:
+        padding = ord(plain_text[-1])
+    else:
+        padding = plain_text[-1]
+    plain_text = plain_text[:-padding]
+    if not as_bytes and hasattr(plain_text, 'decode'):
+        plain_text = plain_text.decode('utf-8')
+    if LOGGER.isEnabledFor(TRACE):
         _log_debug(salt, key, iv_, source_text, plain_text,
-            passphrase=passphrase, debug_stmt=debug_stmt)
+            debug_stmt=debug_stmt if debug_stmt else "decrypt")
     return plain_text
 
 
-def encrypt(source_text, passphrase, debug_stmt=None):
+@_instrument('encrypt', lambda data, result: len(data))
+def encrypt(source_text, passphrase, debug_stmt=None, output_format=None):
     """
     Returns *source_text* as a base64 AES encrypted string.
 
-    The full encrypted text is special crafted to be compatible
-    with openssl. It can be decrypted with:
+    By default (``OPENSSL_FORMAT``), the full encrypted text is special
+    crafted to be compatible with openssl. It can be decrypted with:
 
         $ echo _full_encypted_ | openssl aes-256-cbc -d -a -k _passphrase_ -p
         salt=...
         key=...
         iv=...
         _source_text_
+
+    With ``AEAD_FORMAT``, the text is encrypted with AES-GCM in a versioned
+    envelope, with a key derived once per *passphrase*.
     """
     if debug_stmt is None:
         debug_stmt = "encrypt"
+    if hasattr(source_text, 'encode'):
+        source_utf8 = source_text.encode('utf-8')
+    elif isinstance(source_text, bytes):
+        source_utf8 = source_text
+    else:
+        source_utf8 = str(source_text).encode('utf-8')
+    if output_format == AEAD_FORMAT:
+        return _aead_encrypt(source_utf8, passphrase)
+
     prefix = b'Salted__'
     salt = os.urandom(IV_BLOCK_SIZE - len(prefix))
+    # The salt is random so there is no point caching the derived key here.
     key, iv_ = _openssl_key_iv(passphrase, salt)
-    cipher = Cipher(
-        algorithms.AES(key), modes.CBC(iv_), default_backend()
-    ).encryptor()
+    cipher = Cipher(algorithms.AES(key), modes.CBC(iv_), _BACKEND).encryptor()
 
     # PKCS#7 padding
-    if hasattr(source_text, 'encode'):
-        source_utf8 = source_text.encode('utf-8')
-    else:
-        source_utf8 = str(source_text)
     padding = (IV_BLOCK_SIZE - len(source_utf8) % IV_BLOCK_SIZE)
     if six.PY2:
         padding = chr(padding) * padding
     else:
-        padding = bytes([padding for _ in range(padding)])
+        padding = bytes((padding,)) * padding
     plain_text = source_utf8 + padding
     encrypted_text = cipher.update(plain_text) + cipher.finalize()
     full_encrypted = b64encode(prefix + salt + encrypted_text)
-    _log_debug(salt, key, iv_, full_encrypted, source_text,
-        passphrase=passphrase, debug_stmt=debug_stmt)
+    if LOGGER.isEnabledFor(TRACE):
+        _log_debug(salt, key, iv_, full_encrypted, source_text,
+            debug_stmt=debug_stmt)
     return full_encrypted
+
+
+def _to_bytes(chunk):
+    if hasattr(chunk, 'encode'):
+        return chunk.encode('ascii')
+    return chunk
+
+
+@_instrument('encrypt_file', lambda data, result: result)
+def encrypt_file(in_file, out_file, passphrase, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Reads plain text from *in_file* and writes it to *out_file* as base64
+    AES encrypted text, *chunk_size* bytes at a time. Returns the number
+    of plain text bytes that were encrypted.
+
+    The output is identical in format to the output of openssl, i.e. it can
+    be decrypted with:
+
+        $ openssl aes-256-cbc -d -a -k _passphrase_ -in _out_file_
+    """
+    prefix = b'Salted__'
+    salt = os.urandom(IV_BLOCK_SIZE - len(prefix))
+    key, iv_ = _openssl_key_iv(passphrase, salt)
+    cipher = Cipher(algorithms.AES(key), modes.CBC(iv_), _BACKEND).encryptor()
+    padder = PKCS7(algorithms.AES.block_size).padder()
+    # Encrypted bytes waiting to be base64 encoded as full lines.
+    pending = bytearray(prefix + salt)
+    buf = bytearray(chunk_size + 2 * IV_BLOCK_SIZE)
+    nb_plain_bytes = 0
+    while True:
+        chunk = in_file.read(chunk_size)
+        if not chunk:
+            break
+        if hasattr(chunk, 'encode'):
+            chunk = chunk.encode('utf-8')
+        nb_plain_bytes += len(chunk)
+        padded = padder.update(chunk)
+        if len(padded) + IV_BLOCK_SIZE > len(buf):
+            # text files might read more bytes than characters.
+            buf = bytearray(len(padded) + IV_BLOCK_SIZE)
+        nb_bytes = cipher.update_into(padded, buf)
+        pending += memoryview(buf)[:nb_bytes]
+        pending = _write_b64_lines(pending, out_file)
+    pending += cipher.update(padder.finalize()) + cipher.finalize()
+    _write_b64_lines(pending, out_file, final=True)
+    return nb_plain_bytes
+
+
+def _write_b64_lines(pending, out_file, final=False):
+    """
+    Writes the longest prefix of *pending* that fills complete base64 lines
+    (all of *pending* when *final* is True) and returns the remaining bytes.
+    """
+    view = memoryview(pending)
+    end = len(view)
+    if not final:
+        end -= end % B64_LINE_BYTES
+    out_file.write(b''.join([b2a_base64(view[idx:idx + B64_LINE_BYTES])
+        for idx in range(0, end, B64_LINE_BYTES)]))
+    remains = bytearray(view[end:])
+    view.release()
+    return remains
+
+
+@_instrument('decrypt_file', lambda data, result: result)
+def decrypt_file(in_file, out_file, passphrase, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Reads base64 AES encrypted text from *in_file* and writes the plain text
+    bytes to *out_file*, *chunk_size* bytes at a time. Returns the number
+    of plain text bytes written.
+
+    *in_file* only needs a `read(size)` method, so for example the streaming
+    body of an S3 object can be decrypted as it is downloaded. This function
+    accepts text as generated by openssl, with or without line breaks:
+
+        $ openssl aes-256-cbc -a -k _passphrase_ -in _in_file_
+
+    Payloads in the versioned envelope (``AEAD_FORMAT``) are authenticated
+    as a whole so they are buffered before being decrypted.
+    """
+    cipher = None
+    unpadder = PKCS7(algorithms.AES.block_size).unpadder()
+    # Base64 characters waiting for a multiple of 4 to be decoded.
+    pending = b''
+    # Decoded bytes until we know the payload format and salt.
+    header = bytearray()
+    envelope = None
+    buf = bytearray(chunk_size + IV_BLOCK_SIZE)
+    nb_plain_bytes = 0
+    while True:
+        chunk = in_file.read(chunk_size)
+        last = not chunk
+        if not last:
+            pending += _to_bytes(chunk).translate(None, b' \t\r\n')
+            end = len(pending) - len(pending) % 4
+        else:
+            end = len(pending)
+        encrypted = a2b_base64(pending[:end])
+        pending = pending[end:]
+        if envelope is not None:
+            envelope += encrypted
+            encrypted = b''
+        elif cipher is None:
+            header += encrypted
+            encrypted = b''
+            if header[:len(AEAD_VERSION)] == AEAD_VERSION:
+                envelope = header
+            elif len(header) >= IV_BLOCK_SIZE:
+                if header[:8] != b'Salted__':
+                    raise ValueError("missing 'Salted__' header")
+                cipher = _openssl_cipher(
+                    passphrase, bytes(header[8:IV_BLOCK_SIZE]))[2]
+                cipher = cipher.decryptor()
+                encrypted = bytes(header[IV_BLOCK_SIZE:])
+        if encrypted:
+            if len(encrypted) + IV_BLOCK_SIZE > len(buf):
+                buf = bytearray(len(encrypted) + IV_BLOCK_SIZE)
+            nb_bytes = cipher.update_into(encrypted, buf)
+            plain_text = unpadder.update(memoryview(buf)[:nb_bytes])
+            out_file.write(plain_text)
+            nb_plain_bytes += len(plain_text)
+        if last:
+            break
+    if envelope is not None:
+        plain_text = _aead_decrypt(bytes(envelope), passphrase)
+    elif cipher is not None:
+        plain_text = unpadder.update(cipher.finalize()) + unpadder.finalize()
+    elif header:
+        raise ValueError("truncated encrypted payload")
+    else:
+        plain_text = b''
+    out_file.write(plain_text)
+    return nb_plain_bytes + len(plain_text)
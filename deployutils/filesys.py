@@ -22,11 +22,175 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import datetime, os
+import datetime, hashlib, json, logging, os, tempfile
 
 from pytz import utc
 
 
+LOGGER = logging.getLogger(__name__)
+
+# Files are hashed that many bytes at a time.
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(pathname):
+    """
+    Returns the hex MD5 digest of the content of *pathname*, i.e. the ETag
+    S3 uses for files uploaded in a single part.
+    """
+    digest = hashlib.md5()
+    with open(pathname, 'rb') as content:
+        for chunk in iter(lambda: content.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DigestCache(object):
+    """
+    Content digests of local files indexed by absolute path, and valid
+    as long as the size, modification time and inode of the file
+    are unchanged.
+
+    When *path* is specified, the cache is loaded from and saved to
+    that file, such that unchanged files are not hashed again
+    on the next run.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.nb_hashed = 0
+        self._entries = {}
+        self._modified = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    self._entries = json.load(cache_file)
+            except (IOError, ValueError) as err:
+                LOGGER.warning("ignoring digest cache %s: %s", path, err)
+
+    def digest(self, pathname, signature=None):
+        """
+        Returns the hex MD5 digest of the content of *pathname*.
+        *signature* is the (size, mtime_ns, inode) tuple of the file
+        when the caller already has it (see ``LocalFile.signature``).
+        """
+        pathname = os.path.abspath(pathname)
+        if signature is None:
+            stat_result = os.stat(pathname)
+            signature = (stat_result.st_size, stat_result.st_mtime_ns,
+                stat_result.st_ino)
+        signature = list(signature)
+        entry = self._entries.get(pathname)
+        if entry and entry[:3] == signature:
+            return entry[3]
+        digest = file_digest(pathname)
+        self.nb_hashed += 1
+        self._entries[pathname] = signature + [digest]
+        self._modified = True
+        return digest
+
+    def save(self):
+        """
+        Writes the cache to ``path`` if it was modified.
+        """
+        if not self.path or not self._modified:
+            return
+        dirname = os.path.dirname(self.path)
+        try:
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            # Writes then renames such that a reader never sees
+            # a partial file.
+            fdesc, tmp_path = tempfile.mkstemp(dir=dirname or None)
+            with os.fdopen(fdesc, 'w') as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            # The cache is only an optimization (ex: read-only $HOME).
+            LOGGER.warning("cannot save digest cache %s: %s", self.path, err)
+            self.path = None
+            return
+        self._modified = False
+
+
+# Format of the timestamps in the dictionnaries returned by `list_local`.
+LAST_MODIFIED_FORMAT = '%a, %d %b %Y %H:%M:%S %Z'
+
+
+class LocalFile(object):
+    """
+    A file found by ``walk_local``, identified by *key* (the path
+    without the walk prefix).
+    """
+    __slots__ = ('key', 'path', 'size', 'mtime_ns', 'inode')
+
+    def __init__(self, key, path, stat_result):
+        self.key = key
+        self.path = path
+        self.size = stat_result.st_size
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.inode = stat_result.st_ino
+
+    def __repr__(self):
+        return "LocalFile(%r, mtime=%r, size=%r)" % (
+            self.key, self.mtime, self.size)
+
+    @property
+    def mtime(self):
+        """
+        Last modified time in seconds since Epoch
+        """
+        return self.mtime_ns / 1e9
+
+    @property
+    def signature(self):
+        return (self.size, self.mtime_ns, self.inode)
+
+    def as_dict(self):
+        """
+        Returns the file as formatted by ``list_local``.
+        """
+        return {"Key": self.key,
+            "LastModified": datetime.datetime.fromtimestamp(
+                self.mtime, tz=utc).strftime(LAST_MODIFIED_FORMAT)}
+
+
+def walk_local(paths, prefix=None):
+    """
+    Yields a ``LocalFile`` for each file (recursively) present in *paths*.
+    The key of a file is its path without *prefix*. Paths that do not
+    exist are skipped.
+
+    Directories are walked iteratively with ``os.scandir`` so that
+    the stat information of a file is read with a single system call.
+    """
+    def _key(fullpath):
+        if prefix and fullpath.startswith(prefix):
+            return fullpath[len(prefix):]
+        return fullpath
+
+    for path in paths:
+        if not os.path.isdir(path):
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield LocalFile(_key(path), path, stat_result)
+            continue
+        dirnames = [path]
+        while dirnames:
+            subdirnames = []
+            with os.scandir(dirnames.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirnames += [entry.path]
+                    else:
+                        yield LocalFile(
+                            _key(entry.path), entry.path, entry.stat())
+            # Walks sub-directories in the order they were found.
+            dirnames += reversed(subdirnames)
+
+
 def fingerprint(dirnames, prefix=None, previous=[]):
     #pylint:disable=dangerous-default-value
     """
@@ -40,29 +204,10 @@ def fingerprint(dirnames, prefix=None, previous=[]):
        "LastModified": "Mon, 05 Jan 2015 12:00:001 UTC"},
     ]
     """
-    results = []
-    for dirname in dirnames:
-        for filename in os.listdir(dirname):
-            fullpath = os.path.join(dirname, filename)
-            if os.path.isdir(fullpath):
-                results += fingerprint(
-                    [fullpath], prefix=filename, previous=previous)
-            else:
-                fullname = fullpath
-                if prefix and fullname.startswith(prefix):
-                    fullname = fullname[len(prefix):]
-                found = False
-                for prevpath in previous:
-                    if fullname == prevpath['Key']:
-                        found = True
-                        break
-                if not found:
-                    mtime = datetime.datetime.fromtimestamp(
-                        os.path.getmtime(fullpath), tz=utc)
-                    results += [{"Key": fullname,
-                                 "LastModified": mtime.strftime(
-                                     '%a, %d %b %Y %H:%M:%S %Z')}]
-    return results
+    previous_keys = {prevpath['Key'] for prevpath in previous}
+    return [local_file.as_dict()
+        for local_file in walk_local(dirnames, prefix=prefix)
+        if local_file.key not in previous_keys]
 
 
 def list_local(paths, prefix=None):
@@ -77,30 +222,5 @@ def list_local(paths, prefix=None):
        "LastModified": "Mon, 05 Jan 2015 12:00:001 UTC"},
     ]
     """
-    results = []
-    for path in paths:
-        if os.path.isdir(path):
-            for filename in os.listdir(path):
-                fullpath = os.path.join(path, filename)
-                if os.path.isdir(fullpath):
-                    results += list_local([fullpath], prefix)
-                else:
-                    fullname = fullpath
-                    if prefix and fullname.startswith(prefix):
-                        fullname = fullname[len(prefix):]
-                    mtime = datetime.datetime.fromtimestamp(
-                        os.path.getmtime(fullpath), tz=utc)
-                    results += [{"Key": fullname,
-                        "LastModified": mtime.strftime(
-                                '%a, %d %b %Y %H:%M:%S %Z')}]
-        else:
-            fullpath = path
-            fullname = fullpath
-            if prefix and fullname.startswith(prefix):
-                fullname = fullname[len(prefix):]
-            mtime = datetime.datetime.fromtimestamp(
-                os.path.getmtime(fullpath), tz=utc)
-            results += [{"Key": fullname,
-                "LastModified": mtime.strftime(
-                        '%a, %d %b %Y %H:%M:%S %Z')}]
-    return results
+    return [local_file.as_dict()
+        for local_file in walk_local(paths, prefix=prefix)]
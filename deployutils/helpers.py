@@ -22,7 +22,7 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import datetime, logging, re
+import collections, datetime, functools, logging, re, threading, time
 
 from dateutil.tz import tzlocal
 from pytz import UnknownTimeZoneError, timezone, utc
@@ -31,6 +31,116 @@ import six
 
 LOGGER = logging.getLogger(__name__)
 
+ISO8601_RE = re.compile(r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})'
+    r'(?:[T ](?P<hour>\d{2}):(?P<minute>\d{2})'
+    r'(?::(?P<second>\d{2})(?:\.(?P<fraction>\d+))?)?)?'
+    r'(?P<tzinfo>Z|[+-]\d{2}(?::?\d{2})?)?$')
+
+
+class LRUCache(object):
+    """
+    Bounded, thread-safe, in-memory cache with a least-recently-used
+    eviction policy.
+
+    Entries expire *timeout* seconds after they were set, or earlier
+    when a shorter *timeout* is passed to ``set``. A cache with
+    a *max_size* of zero does not store anything.
+    """
+
+    def __init__(self, max_size=1024, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+        return default
+
+    def set(self, key, value, timeout=None):
+        if self.max_size <= 0:
+            return
+        if timeout is None or (
+                self.timeout is not None and self.timeout < timeout):
+            timeout = self.timeout
+        if timeout is not None and timeout <= 0:
+            # Already expired.
+            return
+        expires_at = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        Returns hits, misses and current size, to help size the cache
+        under real traffic.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+            'size': len(self._entries), 'max_size': self.max_size}
+
+
+class PrefixMatcher(object):
+    """
+    Tests if a path starts with any of a list of *prefixes*.
+
+    Prefixes are indexed once by length, so a match costs one set lookup
+    per distinct prefix length instead of one ``startswith`` per prefix.
+    Prefixes can be lazy objects (ex: ``reverse_lazy``). They are only
+    converted to strings the first time a path is matched.
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = prefixes
+        self._index = None
+
+    def __str__(self):
+        return str([str(prefix) for prefix in self.prefixes])
+
+    def _build_index(self):
+        index = {}
+        for prefix in self.prefixes:
+            prefix = str(prefix)
+            index.setdefault(len(prefix), set()).add(prefix)
+        return sorted(six.iteritems(index))
+
+    def match(self, path):
+        if self._index is None:
+            self._index = self._build_index()
+        for length, prefixes in self._index:
+            if length > len(path):
+                break
+            if path[:length] in prefixes:
+                return True
+        return False
+
 
 def as_timestamp(dtime_at=None):
     if not dtime_at:
@@ -39,6 +149,44 @@ def as_timestamp(dtime_at=None):
         dtime_at - datetime.datetime(1970, 1, 1, tzinfo=utc)).total_seconds())
 
 
+@functools.lru_cache(maxsize=1024)
+def parse_iso8601(dtime_text):
+    """
+    Returns a ``datetime`` from an ISO-8601 formatted string, or ``None``
+    if *dtime_text* cannot be parsed. Results are memoized, as the same
+    timestamps are parsed over and over (ex: subscriptions in sessions).
+    """
+    try:
+        # Python>=3.11 accepts 'Z' and any number of fractional digits.
+        dtime_at = datetime.datetime.fromisoformat(dtime_text)
+    except ValueError:
+        look = ISO8601_RE.match(dtime_text)
+        if not look:
+            return None
+        parts = look.groupdict()
+        fraction = parts['fraction'] or '0'
+        tzinfo = parts['tzinfo']
+        if tzinfo == 'Z':
+            tzinfo = utc
+        elif tzinfo:
+            offset = tzinfo[1:].replace(':', '')
+            offset = datetime.timedelta(
+                hours=int(offset[:2]), minutes=int(offset[2:] or 0))
+            tzinfo = datetime.timezone(
+                -offset if tzinfo.startswith('-') else offset)
+        try:
+            dtime_at = datetime.datetime(int(parts['year']),
+                int(parts['month']), int(parts['day']),
+                int(parts['hour'] or 0), int(parts['minute'] or 0),
+                int(parts['second'] or 0), int(fraction[:6].ljust(6, '0')),
+                tzinfo=tzinfo or None)
+        except ValueError:
+            return None
+    if dtime_at.tzinfo is not None and not dtime_at.utcoffset():
+        dtime_at = dtime_at.replace(tzinfo=utc)
+    return dtime_at
+
+
 def datetime_or_now(dtime_at=None):
     conv_dtime_at = None
     if isinstance(dtime_at, datetime.datetime):
@@ -46,18 +194,7 @@ def datetime_or_now(dtime_at=None):
         conv_dtime_at = dtime_at
     if not conv_dtime_at:
         if isinstance(dtime_at, six.string_types):
-            try:
-                # XXX `parse_datetime`
-                conv_dtime_at = datetime.datetime.strptime(
-                    dtime_at, "%Y-%m-%dT%H:%M:%S.%fZ")
-            except ValueError:
-                pass
-            if not conv_dtime_at:
-                try:
-                    conv_dtime_at = datetime.datetime.strptime(
-                        dtime_at, "%Y-%m-%dT%H:%M:%SZ")
-                except ValueError:
-                    pass
+            conv_dtime_at = parse_iso8601(dtime_at)
             if not conv_dtime_at:
                 try:
                     look = re.match(r'(\d\d\d\d-\d\d-\d\d)(.*)', dtime_at)
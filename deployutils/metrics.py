@@ -0,0 +1,149 @@
+# Copyright (c) 2025, DjaoDjin inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+In-process counters and histograms
+
+Metrics are created (or looked up) by name through a registry, then updated
+from hot paths. A ``snapshot`` of the registry can be logged or exported
+by the application as it sees fit.
+
+    from deployutils.metrics import REGISTRY
+
+    REGISTRY.counter('crypt.decrypt.calls').inc()
+    REGISTRY.histogram('crypt.decrypt.seconds').observe(0.00012)
+"""
+import bisect, threading
+
+
+# Upper bounds (in seconds) of the default histogram buckets.
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+    0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Counter(object):
+    """
+    Monotonically increasing value
+    """
+    __slots__ = ('name', 'value', '_lock')
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram(object):
+    """
+    Distribution of observed values in buckets delimited by *bounds*.
+
+    The last bucket counts the values greater than all *bounds*.
+    """
+    __slots__ = ('name', 'bounds', 'counts', 'count', 'sum', '_lock')
+
+    def __init__(self, name, bounds=None):
+        self.name = name
+        self.bounds = tuple(sorted(bounds if bounds else DEFAULT_BUCKETS))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.sum = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'sum': self.sum,
+                'buckets': list(zip(self.bounds + (float('inf'),),
+                    self.counts))
+            }
+
+
+class MetricsRegistry(object):
+    """
+    Metrics indexed by name
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, metric_class, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = metric_class(name, **kwargs)
+                    self._metrics[name] = metric
+        if not isinstance(metric, metric_class):
+            raise ValueError("metric '%s' is a %s, not a %s" % (
+                name, metric.__class__.__name__, metric_class.__name__))
+        return metric
+
+    def counter(self, name):
+        return self._get_or_create(name, Counter)
+
+    def histogram(self, name, bounds=None):
+        return self._get_or_create(name, Histogram, bounds=bounds)
+
+    def reset(self):
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def snapshot(self, prefix=None):
+        """
+        Returns a dictionnary of the current value of all metrics whose
+        name starts with *prefix*.
+        """
+        return {name: metric.snapshot()
+            for name, metric in list(self._metrics.items())
+            if not prefix or name.startswith(prefix)}
+
+
+REGISTRY = MetricsRegistry()
@@ -24,96 +24,839 @@
 
 from __future__ import absolute_import
 
-import datetime, logging, time, mimetypes, os
+import calendar, collections, datetime, gzip, json, logging, mimetypes, os
+import sqlite3, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import six
 #pylint:disable=import-error
 from six.moves.urllib.parse import urlparse
 
+from .filesys import LAST_MODIFIED_FORMAT, DigestCache, LocalFile
+from .helpers import parse_iso8601
+
 
 LOGGER = logging.getLogger(__name__)
 
+# Number of files transferred concurrently, and number of attempts
+# for each file before giving up.
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds between two progress reports.
+PROGRESS_INTERVAL = 5
+
+# Files are synced when their last modified timestamps differ (default),
+# or when their content digests differ.
+SYNC_BY_MTIME = 'mtime'
+SYNC_BY_DIGEST = 'digest'
+# Name of the user-defined metadata that holds the MD5 digest of an object
+# (since the ETag of objects uploaded in multiple parts is not one).
+DIGEST_METADATA = 'md5'
+# Seconds after which uploads list the bucket again, even though all files
+# were synced, so that objects deleted or overwritten out-of-band
+# are repaired.
+DEFAULT_CHECKPOINT_TTL = 24 * 3600
+# boto3 uploads files of this size or larger in multiple parts.
+MULTIPART_THRESHOLD = TransferConfig().multipart_threshold
+# Suffix appended to a key prefix to name the manifest of the files
+# stored under that prefix.
+MANIFEST_SUFFIX = '.deployutils-manifest.json.gz'
+MANIFEST_VERSION = 1
+
+
+class TransferProgress(object):
+    """
+    Aggregates the number of files and bytes transferred by worker threads
+    and reports progress and throughput through the log.
+    """
+
+    def __init__(self, action, nb_files, interval=PROGRESS_INTERVAL):
+        self.action = action
+        self.nb_files = nb_files
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.nb_bytes = 0
+        self.started_at = time.monotonic()
+        self._reported_at = self.started_at
+        self._lock = threading.Lock()
+
+    def add_bytes(self, nb_bytes):
+        # called by boto3 from the transfer threads.
+        with self._lock:
+            self.nb_bytes += nb_bytes
+
+    def add_file(self, failed=False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.done += 1
+            now = time.monotonic()
+            if now - self._reported_at < self.interval:
+                return
+            self._reported_at = now
+        self.report()
+
+    def report(self, level=logging.INFO):
+        elapsed = max(time.monotonic() - self.started_at, 0.001)
+        LOGGER.log(level,
+            "%s %d/%d files (%d failed), %d bytes in %.1fs"\
+            " (%.1f files/s, %.1f KB/s)",
+            self.action, self.done, self.nb_files, self.failed,
+            self.nb_bytes, elapsed, self.done / elapsed,
+            self.nb_bytes / elapsed / 1024)
+
+
+SyncPlan = collections.namedtuple('SyncPlan',
+    ['uploads', 'downloads', 'unchanged'])
+
+
+def as_epoch(last_modified):
+    """
+    Returns *last_modified* as a number of seconds since Epoch.
+
+    *last_modified* is either a number, a `datetime` (as returned by boto3),
+    an ISO-8601 string (as returned by older versions of boto) or a string
+    formatted as "Mon, 05 Jan 2015 12:00:00 UTC" (as in the dictionnaries
+    returned by ``filesys.list_local``). Naive datetimes are assumed
+    to be UTC.
+    """
+    if isinstance(last_modified, (int, float)):
+        return last_modified
+    if not isinstance(last_modified, datetime.datetime):
+        if last_modified[:1].isalpha():
+            return calendar.timegm(time.strptime(
+                last_modified, LAST_MODIFIED_FORMAT))
+        dtime_at = parse_iso8601(last_modified)
+        if dtime_at is None:
+            raise ValueError("invalid timestamp '%s'" % last_modified)
+        last_modified = dtime_at
+    if last_modified.tzinfo is None:
+        return calendar.timegm(last_modified.utctimetuple())
+    return last_modified.timestamp()
+
+
+def plan_sync(local_mtimes, remote_mtimes):
+    """
+    Returns the ``SyncPlan`` between two dictionnaries of last modified
+    epoch timestamps indexed by key.
+
+    Keys that only exist locally or that were modified more recently
+    locally are uploaded. Keys that only exist remotely or that were
+    modified more recently remotely are downloaded. Timestamps are
+    compared at a one second precision.
+    """
+    uploads = set()
+    downloads = set()
+    unchanged = set()
+    for key, local_mtime in six.iteritems(local_mtimes):
+        remote_mtime = remote_mtimes.get(key)
+        if remote_mtime is None:
+            uploads.add(key)
+            continue
+        local_mtime = int(local_mtime)
+        remote_mtime = int(remote_mtime)
+        if local_mtime > remote_mtime:
+            uploads.add(key)
+        elif local_mtime < remote_mtime:
+            downloads.add(key)
+        else:
+            unchanged.add(key)
+    for key in remote_mtimes:
+        if key not in local_mtimes:
+            downloads.add(key)
+    return SyncPlan(uploads, downloads, unchanged)
+
+
+def plan_sync_by_digest(local_digests, remote_digests):
+    """
+    Returns the ``SyncPlan`` between two dictionnaries of content digests
+    indexed by key.
+
+    Keys that only exist locally are uploaded, keys that only exist
+    remotely are downloaded, and keys whose digests differ are either
+    uploaded or downloaded depending on the direction of the sync.
+    """
+    uploads = set()
+    downloads = set()
+    unchanged = set()
+    for key, local_digest in six.iteritems(local_digests):
+        if key not in remote_digests:
+            uploads.add(key)
+        elif local_digest == remote_digests[key]:
+            unchanged.add(key)
+        else:
+            uploads.add(key)
+            downloads.add(key)
+    for key in remote_digests:
+        if key not in local_digests:
+            downloads.add(key)
+    return SyncPlan(uploads, downloads, unchanged)
+
+
+RemoteFile = collections.namedtuple('RemoteFile',
+    ['key', 'size', 'etag', 'mtime'])
+
+
+SyncEntry = collections.namedtuple('SyncEntry',
+    ['key', 'size', 'mtime_ns', 'inode', 'digest', 'etag'])
+
+
+class SyncState(object):
+    """
+    State of the last sync between local files and a bucket, stored
+    in a SQLite database at *path*.
+
+    For each key, the state records the size, modification time
+    and inode of the local file, its content digest (if computed) and
+    the ETag of the remote object (if known), at the time it was synced.
+    Checkpoints record that all keys under a set of prefixes were synced.
+
+    Removing the database file forces the next sync to compare
+    all local files against the bucket listing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS files ("\
+                " key TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"\
+                " inode INTEGER, digest TEXT, etag TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS checkpoints ("\
+                " name TEXT PRIMARY KEY, synced_at REAL)")
+
+    def close(self):
+        self._conn.close()
+
+    def entries(self):
+        """
+        Returns a dictionnary of ``SyncEntry`` indexed by key.
+        """
+        return {row[0]: SyncEntry(*row) for row in self._conn.execute(
+            "SELECT key, size, mtime_ns, inode, digest, etag FROM files")}
+
+    def update(self, entries):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files"\
+                " (key, size, mtime_ns, inode, digest, etag)"\
+                " VALUES (?, ?, ?, ?, ?, ?)", entries)
+
+    def checkpoint(self, name):
+        """
+        Returns the time (in seconds since Epoch) of the last complete
+        sync recorded under *name*, or ``None``.
+        """
+        row = self._conn.execute(
+            "SELECT synced_at FROM checkpoints WHERE name = ?",
+            (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, name):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO checkpoints"\
+                " (name, synced_at) VALUES (?, ?)", (name, time.time()))
+
+
+ManifestEntry = collections.namedtuple('ManifestEntry',
+    ['key', 'digest', 'size', 'mtime'])
+
+
+def dump_manifest(entries):
+    """
+    Returns the gzip-compressed JSON manifest of *entries*
+    (an iterable of ``ManifestEntry``).
+    """
+    return gzip.compress(json.dumps({
+        'version': MANIFEST_VERSION,
+        'files': sorted([list(entry) for entry in entries])
+    }, separators=(',', ':')).encode('utf-8'))
+
+
+def load_manifest(content):
+    """
+    Returns a dictionnary of ``ManifestEntry`` indexed by key from
+    the *content* of a manifest, or ``None`` when the manifest
+    was written in an unknown version.
+    """
+    data = json.loads(gzip.decompress(content).decode('utf-8'))
+    if data.get('version') != MANIFEST_VERSION:
+        return None
+    return {row[0]: ManifestEntry(*row) for row in data['files']}
+
+
+def _is_not_found(err):
+    return err.response.get('Error', {}).get('Code') in ('NoSuchKey', '404')
+
+
+def _covering_prefixes(key_prefixes):
+    """
+    Returns the smallest subset of *key_prefixes* that covers all keys
+    starting with any of *key_prefixes*. ``None`` covers the whole bucket.
+    """
+    if key_prefixes is None:
+        return ['']
+    results = []
+    for key_prefix in sorted(key_prefixes):
+        if results and key_prefix.startswith(results[-1]):
+            continue
+        results += [key_prefix]
+    return results
+
 
 class S3Backend(object):
+    """
+    Syncs local files with the keys of a S3 bucket.
 
-    def __init__(self, remote_location, static_root=None, dry_run=False):
+    With *sync_mode* ``SYNC_BY_MTIME``, files are transferred when their
+    last modified timestamps differ. With ``SYNC_BY_DIGEST``, files
+    are transferred when their MD5 digests (as computed through
+    *digest_cache*) differ from the ETag, or from the digest stored
+    in the metadata of objects uploaded in multiple parts.
+
+    With a *sync_state*, the files that were synced are recorded
+    such that later runs only transfer what changed in between
+    (see ``upload`` and ``download``). The state is trusted without
+    listing the bucket for *checkpoint_ttl* seconds after the bucket
+    was last listed.
+
+    ``upload`` also maintains a manifest of the files stored under each
+    of *key_prefixes*, which ``download`` reads instead of listing
+    the bucket.
+
+    *key_prefixes* defaults to ``None``, i.e. the whole bucket. An empty
+    list is rejected, since it most likely means the resources of an app
+    could not be found rather than the app owning the whole bucket.
+    """
+
+    def __init__(self, remote_location, static_root=None, dry_run=False,
+                 max_workers=None, max_attempts=None, key_prefixes=None,
+                 sync_mode=None, digest_cache=None, sync_state=None,
+                 checkpoint_ttl=None):
+        #pylint:disable=too-many-arguments
         self.dry_run = dry_run
+        self.sync_state = sync_state
+        self.checkpoint_ttl = (checkpoint_ttl
+            if checkpoint_ttl is not None else DEFAULT_CHECKPOINT_TTL)
+        self.sync_mode = sync_mode if sync_mode else SYNC_BY_MTIME
+        if self.sync_mode not in (SYNC_BY_MTIME, SYNC_BY_DIGEST):
+            raise ValueError("invalid sync mode '%s'" % str(sync_mode))
+        self.digest_cache = (
+            digest_cache if digest_cache is not None else DigestCache())
         self.static_root = static_root
-        s3_resource = boto3.resource('s3')
+        self.max_workers = max_workers if max_workers else DEFAULT_MAX_WORKERS
+        self.max_attempts = (
+            max_attempts if max_attempts else DEFAULT_MAX_ATTEMPTS)
+        if key_prefixes is not None and not key_prefixes:
+            raise ValueError("no key prefixes to sync with %s"\
+                " (pass key_prefixes=None to sync the whole bucket)" %
+                remote_location)
+        self.key_prefixes = key_prefixes
+        # boto3 clients are thread-safe (resources are not) so all workers
+        # share the client underlying the bucket resource.
+        s3_resource = boto3.resource('s3', config=Config(
+            max_pool_connections=max(10, self.max_workers)))
         self.bucket = s3_resource.Bucket(urlparse(remote_location).netloc)
-        # self.boto_datetime_format = '%a, %d %b %Y %H:%M:%S %Z'
-        # XXX boto seems to have changed the datetime format returned
-        #     when reading a S3 key.
-        self.boto_datetime_format = '%Y-%m-%dT%H:%M:%S.%fZ'
+        self.client = s3_resource.meta.client
 
-    def list(self):
+    def list(self, key_prefixes=None):
         """
-        Returns a list of all files (recursively) present in a bucket
-        with their timestamp.
+        Yields a ``RemoteFile`` for each file (recursively) present
+        in the bucket under *key_prefixes* (defaults to ``key_prefixes``
+        passed to the constructor, or the whole bucket).
+
+        Files are listed one page at a time.
         """
-        return self.bucket.objects.all()
+        if key_prefixes is None:
+            key_prefixes = self.key_prefixes
+        paginator = self.client.get_paginator('list_objects_v2')
+        for key_prefix in _covering_prefixes(key_prefixes):
+            for page in paginator.paginate(
+                    Bucket=self.bucket.name, Prefix=key_prefix):
+                for obj in page.get('Contents', []):
+                    if obj['Key'].endswith(MANIFEST_SUFFIX):
+                        continue
+                    yield RemoteFile(obj['Key'], obj['Size'],
+                        obj.get('ETag', '').strip('"'),
+                        as_epoch(obj['LastModified']))
 
     def _index_by_key(self):
-        index = {}
-        for key in self.list():
-            index[key.name] = key
-        return index
+        return {remote_file.key: remote_file for remote_file in self.list()}
+
+    def _remote_digests(self, local_digests, remote_files):
+        """
+        Returns a dictionnary of content digests of *remote_files*
+        indexed by key.
+
+        The digest of objects uploaded in multiple parts is read from
+        the object metadata, only for keys also present in *local_digests*.
+        """
+        results = {}
+        for remote_file in six.itervalues(remote_files):
+            digest = remote_file.etag
+            if '-' in digest and remote_file.key in local_digests:
+                digest = self._multipart_digest(remote_file.key)
+            results[remote_file.key] = digest
+        return results
+
+    def _multipart_digest(self, key):
+        """
+        Returns the content digest stored in the metadata of *key*,
+        an object uploaded in multiple parts, or ``None``.
+        """
+        resp = self.client.head_object(Bucket=self.bucket.name, Key=key)
+        return resp.get('Metadata', {}).get(DIGEST_METADATA)
+
+    def _local_digests(self, local_files):
+        results = {local_file.key: self.digest_cache.digest(
+            local_file.path, local_file.signature)
+            for local_file in local_files}
+        self.digest_cache.save()
+        return results
+
+    def plan(self, local_files, remote_files=None):
+        """
+        Returns the ``SyncPlan`` between *local_files* (an iterable
+        of ``filesys.LocalFile``) and *remote_files* (a dictionnary
+        of ``RemoteFile`` indexed by key, defaults to listing the bucket).
+        """
+        if remote_files is None:
+            remote_files = self._index_by_key()
+        if self.sync_mode == SYNC_BY_DIGEST:
+            local_digests = self._local_digests(local_files)
+            return plan_sync_by_digest(local_digests,
+                self._remote_digests(local_digests, remote_files))
+        return plan_sync({local_file.key: local_file.mtime
+            for local_file in local_files},
+            {key: remote_file.mtime
+             for key, remote_file in six.iteritems(remote_files)})
 
+    def _get_manifest(self, key_prefix):
+        try:
+            resp = self.client.get_object(Bucket=self.bucket.name,
+                Key=key_prefix + MANIFEST_SUFFIX)
+        except ClientError as err:
+            if _is_not_found(err):
+                return None
+            raise
+        body = resp['Body']
+        try:
+            return load_manifest(body.read())
+        finally:
+            body.close()
+
+    def read_manifest(self):
+        """
+        Returns a dictionnary of ``ManifestEntry`` indexed by key
+        for all files under ``key_prefixes``, or ``None`` when
+        the manifest of any of the prefixes is missing.
+        """
+        results = {}
+        for key_prefix in _covering_prefixes(self.key_prefixes):
+            manifest = self._get_manifest(key_prefix)
+            if manifest is None:
+                return None
+            results.update(manifest)
+        return results
+
+    def _listed_manifest(self, manifest, remote_files):
+        """
+        Returns the entries of *manifest* updated from a listing
+        of the bucket (*remote_files*, a dictionnary of ``RemoteFile``
+        indexed by key).
+
+        Keys that are no longer in the bucket are removed. Keys that were
+        not in *manifest*, or whose size or ETag changed, are added
+        with the ETag as digest, or the digest stored in the metadata
+        of objects uploaded in multiple parts.
+        """
+        results = {}
+        for key, remote_file in six.iteritems(remote_files):
+            entry = manifest.get(key)
+            digest = remote_file.etag
+            if '-' in digest:
+                digest = None
+            if (entry is not None and entry.size == remote_file.size and
+                digest in (None, entry.digest)):
+                results[key] = entry
+                continue
+            if digest is None:
+                digest = self._multipart_digest(key)
+            results[key] = ManifestEntry(
+                key, digest, remote_file.size, remote_file.mtime)
+        return results
+
+    def write_manifest(self, local_files, remote_files=None):
+        """
+        Merges *local_files* into the manifest of each of ``key_prefixes``
+        they are stored under.
+
+        A manifest is stored next to the files it describes, with
+        the key of the file, its MD5 digest, size and last modified
+        epoch timestamp, such that ``download`` can diff the local files
+        against a single object per prefix instead of listing the bucket.
+
+        When the bucket was listed (*remote_files*, a dictionnary
+        of ``RemoteFile`` indexed by key), the manifest also describes
+        the keys that were in the bucket but not in *local_files*.
+        """
+        by_prefixes = collections.OrderedDict(
+            (key_prefix, ([], {})) for key_prefix in _covering_prefixes(
+                self.key_prefixes))
+        for local_file in local_files:
+            for key_prefix, (files, _) in six.iteritems(by_prefixes):
+                if local_file.key.startswith(key_prefix):
+                    files += [local_file]
+                    break
+        local_keys = {local_file.key for local_file in local_files}
+        for remote_file in six.itervalues(remote_files or {}):
+            if remote_file.key in local_keys:
+                continue
+            for key_prefix, (_, remotes) in six.iteritems(by_prefixes):
+                if remote_file.key.startswith(key_prefix):
+                    remotes[remote_file.key] = remote_file
+                    break
+        for key_prefix, (files, remotes) in six.iteritems(by_prefixes):
+            if not files and remote_files is None:
+                continue
+            manifest = self._get_manifest(key_prefix) or {}
+            if remote_files is not None:
+                updated = self._listed_manifest(manifest, remotes)
+            else:
+                updated = dict(manifest)
+            for local_file in files:
+                updated[local_file.key] = ManifestEntry(local_file.key,
+                    self.digest_cache.digest(
+                        local_file.path, local_file.signature),
+                    local_file.size, local_file.mtime)
+            if updated == manifest:
+                continue
+            LOGGER.info("write manifest of %d files to %s", len(updated),
+                "s3://%s/%s%s" % (self.bucket.name, key_prefix,
+                MANIFEST_SUFFIX))
+            self.client.put_object(Bucket=self.bucket.name,
+                Key=key_prefix + MANIFEST_SUFFIX,
+                Body=dump_manifest(six.itervalues(updated)),
+                ContentType='application/gzip')
+        self.digest_cache.save()
 
     def _updated_s3_keys(self, local_files):
-        # pylint: disable=too-many-locals
-        uploads = []
-        downloads = []
-        s3_keys = self._index_by_key()
-        for local_meta in local_files:
-            if local_meta['Key'] in s3_keys:
-                s3_key = s3_keys[local_meta['Key']]
-                s3_datetime = datetime.datetime(*time.strptime(
-                        s3_key.last_modified, self.boto_datetime_format)[0:6])
-                local_datetime = datetime.datetime(*time.strptime(
-                        local_meta['LastModified'],
-                        '%a, %d %b %Y %H:%M:%S %Z')[0:6])
-                if local_datetime > s3_datetime:
-                    uploads += [local_meta['Key']]
-                elif local_datetime < s3_datetime:
-                    downloads += [local_meta['Key']]
+        plan = self.plan(local_files)
+        return sorted(plan.downloads), sorted(plan.uploads)
+
+    @property
+    def checkpoint_name(self):
+        """
+        Identifies the bucket and key prefixes in the sync state.
+        """
+        return 's3://%s/%s' % (self.bucket.name,
+            ','.join(_covering_prefixes(self.key_prefixes)))
+
+    def _is_checkpointed(self):
+        """
+        Returns True if all files under ``key_prefixes`` were found
+        in sync when the bucket was listed less than ``checkpoint_ttl``
+        seconds ago.
+        """
+        if self.sync_state is None:
+            return False
+        synced_at = self.sync_state.checkpoint(self.checkpoint_name)
+        return bool(synced_at and
+            time.time() - synced_at < self.checkpoint_ttl)
+
+    def _is_synced(self, local_file, entry):
+        """
+        Returns True if *local_file* is in the state it was in when
+        it was last synced (i.e. *entry*).
+        """
+        if entry is None:
+            return False
+        if local_file.signature == (entry.size, entry.mtime_ns, entry.inode):
+            return True
+        return bool(self.sync_mode == SYNC_BY_DIGEST and entry.digest and
+            self.digest_cache.digest(local_file.path, local_file.signature)
+            == entry.digest)
+
+    def _save_state(self, local_files, etags, checkpoint=False):
+        """
+        Records *local_files* as synced with the bucket, where *etags*
+        are the ETags of the corresponding keys, when known.
+        When *checkpoint* is True, also records that all files
+        under ``key_prefixes`` were found in sync with a listing
+        of the bucket.
+        """
+        if self.sync_state is None or self.dry_run:
+            return
+        entries = []
+        for local_file in local_files:
+            digest = None
+            if self.sync_mode == SYNC_BY_DIGEST:
+                digest = self.digest_cache.digest(
+                    local_file.path, local_file.signature)
+            entries += [SyncEntry(local_file.key, local_file.size,
+                local_file.mtime_ns, local_file.inode, digest,
+                etags.get(local_file.key))]
+        self.sync_state.update(entries)
+        if checkpoint:
+            self.sync_state.set_checkpoint(self.checkpoint_name)
+        self.digest_cache.save()
+
+    def _transfer(self, action, tasks, func, completed=None):
+        """
+        Calls *func(task, progress)* for each item in *tasks* from a pool
+        of ``max_workers`` threads, retrying a task up to ``max_attempts``
+        times. At most twice ``max_workers`` tasks are in flight at a time.
+        Tasks that succeeded are appended to *completed* when specified.
+
+        Raises the first error encountered after all tasks were attempted.
+        """
+        progress = TransferProgress(action, len(tasks))
+        if completed is None:
+            completed = []
+
+        def _run(task):
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    func(task, progress)
+                    break
+                except Exception as err: #pylint:disable=broad-except
+                    if attempt >= self.max_attempts:
+                        raise
+                    LOGGER.warning("%s %s failed (attempt %d/%d): %s",
+                        action, task, attempt, self.max_attempts, err)
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+
+        first_error = None
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for task in tasks:
+                if len(in_flight) >= 2 * self.max_workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    first_error = self._collect(done, in_flight, progress,
+                        completed, first_error)
+                in_flight[executor.submit(_run, task)] = task
+            done, _ = wait(in_flight)
+            first_error = self._collect(done, in_flight, progress,
+                completed, first_error)
+        progress.report()
+        if first_error is not None:
+            raise first_error
+
+    @staticmethod
+    def _collect(futures, in_flight, progress, completed, first_error):
+        #pylint:disable=too-many-arguments
+        for future in futures:
+            task = in_flight.pop(future)
+            err = future.exception()
+            progress.add_file(failed=err is not None)
+            if err is not None:
+                LOGGER.error("%s %s failed: %s", progress.action, task, err)
+                if first_error is None:
+                    first_error = err
             else:
-                uploads += [local_meta['Key']]
-        for s3_meta in s3_keys:
-            if not s3_meta in local_files:
-                downloads += [s3_meta]
-        return downloads, uploads
+                completed += [task]
+        return first_error
+
+    def _listed_downloads(self, local_files):
+        """
+        Returns the keys to download after listing the bucket, the keys
+        already in sync, and the ETags of all keys in the bucket.
+
+        With a sync state, keys whose ETag and local file did not change
+        since they were last synced are skipped without further comparison.
+        """
+        remote_files = self._index_by_key()
+        synced = set()
+        if self.sync_state is not None:
+            entries = self.sync_state.entries()
+            for key, remote_file in six.iteritems(remote_files):
+                entry = entries.get(key)
+                if (key in local_files and entry is not None and
+                    entry.etag == remote_file.etag and
+                    self._is_synced(local_files[key], entry)):
+                    synced.add(key)
+        plan = self.plan(
+            [local_file for key, local_file in six.iteritems(local_files)
+             if key not in synced],
+            {key: remote_file
+             for key, remote_file in six.iteritems(remote_files)
+             if key not in synced})
+        synced |= plan.unchanged
+        return sorted(plan.downloads), synced, {key: remote_file.etag
+            for key, remote_file in six.iteritems(remote_files)}
+
+    def _manifest_downloads(self, local_files, manifest):
+        """
+        Returns the keys in *manifest* that are missing locally or whose
+        content differ, the keys already in sync, and the ETags of all
+        keys in *manifest* (when known from the sync state).
+
+        Files are compared by size first, then by digest.
+        """
+        entries = {}
+        if self.sync_state is not None:
+            entries = self.sync_state.entries()
+        downloads = []
+        synced = set()
+        etags = {}
+        for key, manifest_entry in six.iteritems(manifest):
+            etags[key] = None
+            local_file = local_files.get(key)
+            if (local_file is None or local_file.size != manifest_entry.size
+                or self.digest_cache.digest(local_file.path,
+                    local_file.signature) != manifest_entry.digest):
+                downloads += [key]
+                continue
+            synced.add(key)
+            entry = entries.get(key)
+            if entry is not None and self._is_synced(local_file, entry):
+                etags[key] = entry.etag
+        self.digest_cache.save()
+        return sorted(downloads), synced, etags
 
     def download(self, local_files, prefix=''):
-        downloads, _ = self._updated_s3_keys(local_files)
-        for filename in downloads:
-            headers = {}
+        """
+        Downloads the files that changed in the bucket.
+
+        When a manifest was written for each of ``key_prefixes``
+        (see ``write_manifest``), the local files are compared against
+        the manifests instead of listing the bucket. The bucket is listed
+        anyway when a file in the manifests is missing from the bucket.
+        """
+        local_files = {local_file.key: local_file
+            for local_file in local_files}
+        manifest = self.read_manifest()
+        if manifest is None:
+            downloads, synced, etags = self._listed_downloads(local_files)
+        else:
+            downloads, synced, etags = self._manifest_downloads(
+                local_files, manifest)
+        if self.dry_run:
+            dry_run = "(dry run) "
+        else:
+            dry_run = ""
+
+        missing = []
+
+        def _download(filename, progress):
             pathname = prefix + filename
-            content_type = mimetypes.guess_type(pathname)[0]
-            if content_type:
-                headers['Content-Type'] = content_type
-            if self.dry_run:
-                dry_run = "(dry run) "
-            else:
-                dry_run = ""
             LOGGER.info("%sdownload %s to %s", dry_run, filename, pathname)
             if not self.dry_run:
-                if not os.path.exists(os.path.dirname(pathname)):
-                    os.makedirs(os.path.dirname(pathname))
-                self.bucket.download_file(filename, pathname)
+                dirname = os.path.dirname(pathname)
+                if dirname:
+                    os.makedirs(dirname, exist_ok=True)
+                try:
+                    self.client.download_file(self.bucket.name, filename,
+                        pathname, Callback=progress.add_bytes)
+                except ClientError as err:
+                    if manifest is None or not _is_not_found(err):
+                        raise
+                    # The manifest is out-of-date.
+                    missing.append(filename)
+
+        completed = []
+        try:
+            self._transfer('download', downloads, _download,
+                completed=completed)
+            if missing:
+                LOGGER.warning("%d files in the manifest are missing"\
+                    " from s3://%s (ex: %s), listing the bucket instead.",
+                    len(missing), self.bucket.name, missing[0])
+                completed[:] = [key for key in completed
+                    if key not in missing]
+                for key in completed:
+                    local_files[key] = LocalFile(
+                        key, prefix + key, os.stat(prefix + key))
+                manifest = None
+                downloads, synced, etags = self._listed_downloads(
+                    local_files)
+                self._transfer('download', downloads, _download,
+                    completed=completed)
+        finally:
+            if self.sync_state is not None and not self.dry_run:
+                completed = set(completed)
+                synced_files = [local_files[key] for key in synced
+                    if key not in completed] + [
+                    LocalFile(key, prefix + key, os.stat(prefix + key))
+                    for key in completed]
+                # Only a listing of the bucket can prove no object
+                # was deleted or overwritten out-of-band.
+                self._save_state(synced_files, etags,
+                    checkpoint=(manifest is None and
+                        len(synced_files) == len(etags)))
+
+    def _uploaded_by_us(self, local_files, remote_files, keys):
+        """
+        Returns the subset of *keys* that are more recent in the bucket
+        than locally only because they were uploaded from the local file,
+        i.e. the local file did not change since it was last synced
+        and the ETag is the one recorded at the time.
+
+        The ETag of objects uploaded in multiple parts is not known
+        until the bucket is listed, so it is trusted the first time.
+        """
+        if self.sync_state is None or not keys:
+            return set()
+        entries = self.sync_state.entries()
+        results = set()
+        for local_file in local_files:
+            if local_file.key not in keys:
+                continue
+            entry = entries.get(local_file.key)
+            etag = remote_files[local_file.key].etag
+            if (self._is_synced(local_file, entry) and
+                (entry.etag == etag or (entry.etag is None and '-' in etag))):
+                results.add(local_file.key)
+        return results
 
     def upload(self, local_files, prefix=""):
-        _, uploads = self._updated_s3_keys(local_files)
-        for filename in uploads:
-            headers = {}
+        """
+        Uploads the local files that changed.
+
+        Once a sync state was checkpointed by a previous run, the bucket
+        is not listed again until the checkpoint expires. Files are
+        uploaded when their local stat (or digest) changed since they
+        were last synced.
+        """
+        local_files = list(local_files)
+        listed = not self._is_checkpointed()
+        remote_files = None
+        if not listed:
+            entries = self.sync_state.entries()
+            uploads = sorted(local_file.key for local_file in local_files
+                if not self._is_synced(local_file, entries.get(
+                    local_file.key)))
+            unchanged = {local_file.key for local_file in local_files}
+            unchanged -= set(uploads)
+            etags = {key: entries[key].etag for key in unchanged}
+        else:
+            remote_files = self._index_by_key()
+            plan = self.plan(local_files, remote_files)
+            uploads = sorted(plan.uploads)
+            unchanged = plan.unchanged - plan.uploads
+            unchanged |= self._uploaded_by_us(local_files, remote_files,
+                plan.downloads - plan.uploads)
+            etags = {key: remote_files[key].etag for key in unchanged}
+        if self.dry_run:
+            dry_run = "(dry run) "
+        else:
+            dry_run = ""
+
+        def _upload(filename, progress):
+            extra_args = {}
             pathname = prefix + filename
             content_type = mimetypes.guess_type(pathname)[0]
             if content_type:
-                headers['Content-Type'] = content_type
-            if self.dry_run:
-                dry_run = "(dry run) "
-            else:
-                dry_run = ""
+                extra_args['ContentType'] = content_type
             policy = None
             if self.static_root and pathname.startswith(self.static_root):
                 # By convention these are assets for browsers (css,js,etc)
@@ -121,10 +864,30 @@ class S3Backend(object):
             LOGGER.info("%supload %s to %s%s", dry_run, pathname,
                 "s3://%s/%s" % (self.bucket.name, filename),
                 "(%s)" % policy if policy else "")
-            extra_args = {}
-            extra_args.update(headers)
             if policy:
                 extra_args.update({'ACL': policy})
+            if self.sync_mode == SYNC_BY_DIGEST:
+                # Large files are uploaded in multiple parts, in which case
+                # the ETag is not the digest of the content.
+                extra_args.update({'Metadata': {
+                    DIGEST_METADATA: self.digest_cache.digest(pathname)}})
+            if not self.dry_run:
+                self.client.upload_file(pathname, self.bucket.name, filename,
+                    ExtraArgs=extra_args, Callback=progress.add_bytes)
+                if (self.sync_state is not None and
+                    os.path.getsize(pathname) < MULTIPART_THRESHOLD):
+                    # The ETag of an object uploaded in a single part
+                    # is the MD5 digest of its content.
+                    etags[filename] = self.digest_cache.digest(pathname)
+
+        completed = []
+        try:
+            self._transfer('upload', uploads, _upload, completed=completed)
+        finally:
             if not self.dry_run:
-                self.bucket.upload_file(pathname, filename,
-                    ExtraArgs=extra_args)
+                synced = unchanged | set(completed)
+                synced_files = [local_file for local_file in local_files
+                    if local_file.key in synced]
+                self._save_state(synced_files, etags,
+                    checkpoint=(listed and len(synced) == len(local_files)))
+                self.write_manifest(synced_files, remote_files=remote_files)
@@ -0,0 +1,65 @@
+# Copyright (c) 2026, DjaoDjin inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from deployutils.apps.django_deployutils.backends.auth import (USERS,
+    ProxyUserBackend)
+from deployutils.apps.django_deployutils.backends.session_base import (
+    SESSION_AUTH_HASHES, SessionStore)
+
+
+class CachedUserInvalidationTests(TestCase):
+
+    def setUp(self):
+        USERS.clear()
+        SESSION_AUTH_HASHES.clear()
+        self.backend = ProxyUserBackend()
+        self.session_data = {'username': 'donny', 'email': 'donny@example.com'}
+
+    def test_deactivated_user(self):
+        user = self.backend.authenticate(self.session_data, 'donny')
+        self.assertIsNotNone(user)
+        SessionStore.get_session_auth_hash(user)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(self.backend.get_user(user.pk))
+        user.is_active = False
+        user.save()
+        self.assertIsNone(SESSION_AUTH_HASHES.get(user.pk))
+        self.assertIsNone(self.backend.get_user(user.pk))
+        self.assertIsNone(self.backend.authenticate(self.session_data, 'donny'))
+
+    def test_renamed_user(self):
+        user = self.backend.authenticate(self.session_data, 'donny')
+        user.username = 'donald'
+        user.save()
+        self.assertEqual(self.backend.get_user(user.pk).username, 'donald')
+        self.assertIsNone(USERS.get(('username', 'donny')))
+
+    def test_deleted_user(self):
+        user = self.backend.authenticate(self.session_data, 'donny')
+        user_id = user.pk
+        get_user_model().objects.filter(pk=user_id).delete()
+        self.assertIsNone(self.backend.get_user(user_id))
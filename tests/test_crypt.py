@@ -0,0 +1,129 @@
+# Copyright (c) 2026, DjaoDjin inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime, decimal, enum, json, unittest, uuid
+
+from deployutils import crypt
+from deployutils.metrics import REGISTRY
+
+
+class Color(enum.Enum):
+    RED = 1
+
+
+class Level(enum.IntEnum):
+    HIGH = 2
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, cls=crypt.JSONEncoder,
+        separators=(',', ':')).encode('utf-8')
+
+
+class JSONDumpsParityTests(unittest.TestCase):
+    """
+    ``crypt.json_dumps`` writes the same JSON as ``crypt.JSONEncoder``,
+    whether or not orjson is installed.
+    """
+
+    def assertParity(self, obj):
+        #pylint:disable=invalid-name
+        self.assertEqual(crypt.json_dumps(obj), stdlib_dumps(obj))
+
+    def test_session(self):
+        self.assertParity({
+            'username': 'donny', 'exp': 1790000000, 'admin': False,
+            'site': None, 'roles': {'manager': [{
+                'slug': 'acme', 'printable_name': 'Acme',
+                'subscriptions': [{'plan': 'basic',
+                    'ends_at': '2026-01-01T00:00:00Z'}]}]}})
+
+    def test_default_conversions(self):
+        self.assertParity({
+            'at': datetime.datetime(2025, 1, 1, 12, 30),
+            'on': datetime.date(2025, 1, 1),
+            'amount': decimal.Decimal('1.5'),
+            'id': uuid.UUID(int=5),
+            'tuple': (1, 'a')})
+
+    def test_non_finite_floats(self):
+        self.assertParity({'a': float('nan')})
+        self.assertParity([float('inf'), float('-inf')])
+        self.assertParity(float('nan'))
+        self.assertEqual(crypt.json_dumps({'a': float('nan')}), b'{"a":NaN}')
+
+    def test_floats(self):
+        self.assertParity([0.0, -0.0, 0.1, 1 / 3, 0.0001, 1e15,
+            9999999999999998.0, 5e-324])
+        self.assertParity([1e16, 1e-7, -1e-7, 9.99e-05, 1e300])
+        self.assertParity({'exp': 1.5e16})
+        self.assertParity(1e16)
+
+    def test_circular_references(self):
+        data = {}
+        data['x'] = [data]
+        with self.assertRaises(ValueError):
+            crypt.json_dumps(data)
+        shared = {'a': 1}
+        self.assertParity([shared, shared, {'b': shared}])
+
+    def test_enums(self):
+        self.assertParity({'color': Color.RED})
+        self.assertParity({'nested': [{'color': Color.RED}]})
+        self.assertParity([Level.HIGH])
+        self.assertEqual(crypt.json_dumps({'color': Color.RED}),
+            b'{"color":"Color.RED"}')
+
+    def test_keys(self):
+        self.assertParity({1: 'a', 2.5: 'b', True: 'c', None: 'd'})
+        with self.assertRaises(TypeError):
+            stdlib_dumps({datetime.date(2025, 1, 1): 'a'})
+        with self.assertRaises(TypeError):
+            crypt.json_dumps({datetime.date(2025, 1, 1): 'a'})
+
+    def test_large_integers(self):
+        self.assertParity({'big': 2 ** 70})
+
+
+
+class InstrumentTests(unittest.TestCase):
+
+    def test_keyword_arguments(self):
+        nb_bytes = REGISTRY.counter('crypt.encrypt.bytes')
+        start = nb_bytes.value
+        encrypted = crypt.encrypt(source_text='abc', passphrase='pw')
+        self.assertEqual(crypt.decrypt(encrypted, 'pw'), 'abc')
+        self.assertEqual(nb_bytes.value - start, 3)
+
+    def test_measure_errors(self):
+        #pylint:disable=protected-access
+        identity = crypt._instrument('identity',
+            lambda data, result: len(result))(lambda data: data)
+        self.assertIsNone(identity(None))
+        self.assertEqual(
+            REGISTRY.counter('crypt.identity.calls').value, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
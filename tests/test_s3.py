@@ -0,0 +1,235 @@
+# Copyright (c) 2026, DjaoDjin inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime, hashlib, io, os, shutil, sqlite3, tempfile, time, unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from deployutils import s3
+from deployutils.filesys import walk_local
+
+
+class FakeBucket(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakePaginator(object):
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix):
+        #pylint:disable=invalid-name,unused-argument
+        self.client.nb_list += 1
+        yield {'Contents': [{'Key': key, 'Size': len(body),
+            'ETag': '"%s"' % hashlib.md5(body).hexdigest(),
+            'LastModified': datetime.datetime.fromtimestamp(
+                mtime, tz=datetime.timezone.utc)}
+            for key, (body, mtime) in sorted(self.client.objects.items())
+            if key.startswith(Prefix)]}
+
+
+class FakeClient(object):
+    """
+    Keeps the objects of a bucket in memory.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.nb_list = 0
+        self.downloads = []
+        self.uploads = []
+
+    def put(self, key, body, mtime=None):
+        self.objects[key] = (body, mtime if mtime else time.time())
+
+    def get_paginator(self, name):
+        #pylint:disable=unused-argument
+        return FakePaginator(self)
+
+    def get_object(self, Bucket, Key):
+        #pylint:disable=invalid-name,unused-argument
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key][0])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        #pylint:disable=invalid-name,unused-argument
+        self.put(Key, Body)
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None,
+                    Callback=None):
+        #pylint:disable=invalid-name,too-many-arguments,unused-argument
+        self.uploads += [key]
+        with open(filename, 'rb') as upload_file:
+            self.put(key, upload_file.read())
+
+    def download_file(self, bucket, key, filename, Callback=None):
+        #pylint:disable=invalid-name,unused-argument
+        if key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        self.downloads += [key]
+        with open(filename, 'wb') as download_file:
+            download_file.write(self.objects[key][0])
+
+
+class S3BackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        resource = mock.Mock()
+        resource.Bucket = FakeBucket
+        resource.meta.client = self.client
+        patcher = mock.patch.object(s3.boto3, 'resource',
+            return_value=resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def make_node(self, name, files=None):
+        root = os.path.join(self.tmpdir, name) + os.sep
+        os.makedirs(root + 'static')
+        for key, content in (files or {}).items():
+            with open(root + key, 'w') as node_file:
+                node_file.write(content)
+        return root
+
+    def make_backend(self, name=None, **kwargs):
+        sync_state = None
+        if name:
+            sync_state = s3.SyncState(os.path.join(self.tmpdir, name))
+            self.addCleanup(sync_state.close)
+        return s3.S3Backend('s3://bucket', key_prefixes=['static/'],
+            sync_state=sync_state, **kwargs)
+
+    @staticmethod
+    def local_files(root):
+        return list(walk_local([root + 'static/'], root))
+
+    def upload(self, root, backend=None):
+        if backend is None:
+            backend = self.make_backend()
+        backend.upload(self.local_files(root), root)
+
+    def download(self, root, backend=None):
+        if backend is None:
+            backend = self.make_backend()
+        backend.download(self.local_files(root), root)
+
+
+class ManifestTests(S3BackendTestCase):
+
+    def test_cold_start_download(self):
+        src = self.make_node('src', {
+            'static/a.css': 'a', 'static/b.js': 'b'})
+        self.upload(src)
+        self.client.nb_list = 0
+        dst = self.make_node('dst')
+        self.download(dst)
+        self.assertEqual(self.client.nb_list, 0)
+        self.assertEqual(sorted(os.listdir(dst + 'static')),
+            ['a.css', 'b.js'])
+
+    def test_remote_only_keys(self):
+        self.client.put('static/legacy.js', b'legacy')
+        src = self.make_node('src', {'static/a.css': 'a'})
+        self.upload(src)
+        self.client.nb_list = 0
+        dst = self.make_node('dst')
+        self.download(dst)
+        self.assertEqual(self.client.nb_list, 0)
+        self.assertEqual(sorted(os.listdir(dst + 'static')),
+            ['a.css', 'legacy.js'])
+
+    def test_remote_newer_keys(self):
+        src = self.make_node('src', {
+            'static/a.css': 'a', 'static/b.js': 'b'})
+        os.utime(src + 'static/b.js', (1, 1))
+        self.client.put('static/b.js', b'newer')
+        self.upload(src)
+        self.assertEqual(self.client.uploads, ['static/a.css'])
+        self.client.nb_list = 0
+        dst = self.make_node('dst', {'static/b.js': 'b'})
+        self.download(dst)
+        self.assertEqual(self.client.nb_list, 0)
+        with open(dst + 'static/b.js') as downloaded:
+            self.assertEqual(downloaded.read(), 'newer')
+
+    def test_deleted_keys(self):
+        src = self.make_node('src', {
+            'static/a.css': 'a', 'static/b.js': 'b'})
+        self.upload(src)
+        del self.client.objects['static/b.js']
+        self.client.nb_list = 0
+        dst = self.make_node('dst')
+        self.download(dst, backend=self.make_backend('dst.sqlite'))
+        self.assertEqual(self.client.nb_list, 1)
+        self.assertEqual(os.listdir(dst + 'static'), ['a.css'])
+
+        # The next upload drops the deleted key from the manifest.
+        os.remove(src + 'static/b.js')
+        self.upload(src)
+        self.assertEqual(list(self.make_backend().read_manifest()),
+            ['static/a.css'])
+
+
+class CheckpointTests(S3BackendTestCase):
+
+    def expire_checkpoints(self, name):
+        conn = sqlite3.connect(os.path.join(self.tmpdir, name))
+        with conn:
+            conn.execute("UPDATE checkpoints SET synced_at = ?",
+                (time.time() - s3.DEFAULT_CHECKPOINT_TTL - 1,))
+        conn.close()
+
+    def test_expired_checkpoint(self):
+        src = self.make_node('src', {
+            'static/a.css': 'a', 'static/b.js': 'b'})
+        for key in ('static/a.css', 'static/b.js'):
+            # Objects are always more recent in the bucket than
+            # the files they were uploaded from.
+            os.utime(src + key, (1, 1))
+        self.upload(src, backend=self.make_backend('src.sqlite'))
+        self.assertEqual(self.client.nb_list, 1)
+        self.expire_checkpoints('src.sqlite')
+        self.upload(src, backend=self.make_backend('src.sqlite'))
+        self.assertEqual(self.client.nb_list, 2)
+        self.upload(src, backend=self.make_backend('src.sqlite'))
+        self.assertEqual(self.client.nb_list, 2)
+        self.assertEqual(sorted(self.client.uploads),
+            ['static/a.css', 'static/b.js'])
+
+    def test_overwritten_out_of_band(self):
+        src = self.make_node('src', {'static/a.css': 'a'})
+        os.utime(src + 'static/a.css', (1, 1))
+        self.upload(src, backend=self.make_backend('src.sqlite'))
+        self.client.put('static/a.css', b'overwritten')
+        self.expire_checkpoints('src.sqlite')
+        self.upload(src, backend=self.make_backend('src.sqlite'))
+        self.upload(src, backend=self.make_backend('src.sqlite'))
+        self.assertEqual(self.client.nb_list, 3)
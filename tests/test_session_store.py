@@ -0,0 +1,49 @@
+# Copyright (c) 2026, DjaoDjin inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from deployutils.apps.django_deployutils.backends import jwt_session_store
+
+
+class JWTSessionStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.session_key = jwt_session_store.SessionStore.prepare(
+            {'username': 'donny'})
+
+    def test_save_fresh_token(self):
+        session = jwt_session_store.SessionStore(self.session_key)
+        session.load()
+        session.save()
+        self.assertEqual(session.nb_encodes, 0)
+        self.assertEqual(session.session_key, self.session_key)
+
+    def test_save_modified(self):
+        session = jwt_session_store.SessionStore(self.session_key)
+        session.load()
+        session['roles'] = {}
+        session.save()
+        self.assertEqual(session.nb_encodes, 1)
+        self.assertNotEqual(session.session_key, self.session_key)